@@ -0,0 +1,205 @@
+"""
+قياس كلفة بناء الطلب وتنظيف النص لكل طلب توليد، قبل الجداول المحسوبة مسبقًا وبعدها.
+
+"قبل" هو خط الأساس حرفيًا: generate_response كانت تبني platform_config وجدول اللهجات
+وتعابير التنظيف في كل استدعاء. "بعد" هو build_completion_request + finalize_content الحاليان.
+
+التشغيل من جذر المشروع:
+    python benchmarks/bench_prompt_pipeline.py
+"""
+import os
+import re
+import sys
+import random
+import timeit
+import logging
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.openai_service import build_completion_request, finalize_content  # noqa: E402
+
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "20000"))
+
+PLATFORM = "لينكدإن"
+DIALECT = "اليمنية"
+SAMPLE_INPUT = "إطلاق منتج جديد لتطبيق توصيل الطعام في المدينة"
+SAMPLE_OUTPUT = (
+    "🚀 أطلقنا اليوم تطبيقنا الجديد لتوصيل الطعام! Order now 🍔\n\n\n\n"
+    "اطلب وجبتك المفضلة بضغطة زر،    وسنصلك خلال دقائق.\n"
+    "- سرعة في التوصيل\n- أسعار مناسبة\n- خدمة على مدار الساعة ✨"
+) * 3
+
+
+# ============= خط الأساس (منسوخ من services/openai_service.py في أول إصدار) =============
+SITE_URL = os.getenv('SITE_URL', 'https://your-site.com')
+SITE_NAME = os.getenv('SITE_NAME', 'My Bot')
+
+
+def legacy_clean_content(text):
+    if not text:
+        return ""
+    try:
+        arabic_chars = r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]'
+        allowed_symbols = r'[!؟.,،؛:\n\-#@_ ]'
+        emojis = r'[\U0001F300-\U0001F6FF\u2600-\u26FF\u2700-\u27BF]'
+        cleaned = re.sub(fr'[^\n{arabic_chars}{allowed_symbols}{emojis}]', '', str(text))
+        cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
+        cleaned = re.sub(r'[ ]{2,}', ' ', cleaned)
+        return cleaned.strip()
+    except Exception as e:
+        logging.error(f"خطأ في تنظيف النص: {str(e)}")
+        return str(text)[:500]
+
+
+def legacy_dialect_examples(dialect):
+    examples = {
+        "المغربية": """\
+- استعمل كلمات مثل: "واخّا"، "بزاف"، "دابا"، "خويا"، "نعيقو"، "زعما"، "خاي"، "عفاك"، "مزيان"، "حاجة زوينة"
+- اكتب باللهجة المغربية بأسلوب عام يناسب المنشورات العامة.
+- تجنب العبارات الدردشة الشخصية أو التحايا.
+- أدرج الكلمات ضمن الجمل بشكل منطقي طبيعي بدون مبالغة.
+""",
+        "المصرية": """\
+- استعمل كلمات زي: "يلا بينا"، "جامد أوي"، "كده يعني"، "بص يا معلم"، "حكاية"، "حلو جدًا"، "تمام التمام"، "إوعى تفوتك"، "من الآخر"، "على طول"
+- اكتب باللهجة المصرية بأسلوب عام يناسب المنشورات العامة.
+- تجنب صيغة الدردشة الشخصية.
+- أدرج الكلمات في سياق الجمل بشكل طبيعي.
+""",
+        "اليمنية": """\
+- استخدم كلمات مثل: "عادك"، "شوف"، "معك خبر؟"، "شوية"، "قدك"، "تمام"، "طيب"، "ابسر"، "احزر"، "خليك"، "مرتاح"، "مفتهن"، "ماشي"، "مافيش"، "شوعه"، "حالي"، "شمات"، "سابر"، "طافح"، "أيوه"، "وينك"، "فخر"، "شجاع"، "صنديد"، "قدوة"، "بطل"، "مواقف رجولية"
+- اكتب باللهجة اليمنية بأسلوب عام راقٍ يناسب المنشورات العامة.
+- تجنب العبارات الموجهة لشخص أو دردشة كـ: "عادك تتذكر؟" أو "أوريك"
+- أدرج الكلمات في سياق الجمل بشكل منطقي دون مبالغة.
+""",
+        "الشامية": """\
+- استعمل كلمات مثل: "هلّق"، "شو القصة"، "كتير"، "تمام"، "بالهداوة"، "منيح"، "ياريت"، "عنجد"، "بسيطة"، "عال العال"، "قديش"
+- اكتب باللهجة الشامية بأسلوب عام يناسب المنشورات العامة.
+- تجنب العبارات الحميمية أو الدردشة المباشرة.
+- أدرج الكلمات ضمن الجمل بشكل منطقي طبيعي.
+""",
+        "الخليجية": """\
+- استعمل كلمات مثل: "تصدق"، "زين"، "يا طويل العمر"، "وش السالفة"، "مرة"، "واجد"، "على طاري"، "حيل"، "يا بعد حيي"، "طيّب"، "معقولة"
+- اكتب باللهجة الخليجية بأسلوب عام يناسب المنشورات العامة.
+- تجنب صيغة السوالف أو المجالس.
+- أدرج الكلمات في سياق الجمل بشكل منطقي طبيعي.
+"""
+    }
+    return examples.get(dialect, "")
+
+
+def legacy_generate_request(user_input, platform, dialect=None, content=SAMPLE_OUTPUT):
+    """جسم generate_response في خط الأساس لمنصة غير تويتر، مع إعادة وسائط الطلب بدل إرساله.
+
+    الجداول تُبنى داخل الدالة في كل استدعاء كما كانت، وهي الكلفة المقصودة بالقياس.
+    """
+    platform_config = {
+        "تويتر": {
+            "generator": None,  # generate_twitter_post في الأصل؛ مسار تويتر لا يُقاس هنا
+            "emojis": ["🔥", "💡", "🚀", "✨", "🎯"],
+        },
+        "لينكدإن": {
+            "model": "meta-llama/llama-4-maverick:free",
+            "max_tokens": 600,
+            "template": """
+أنت كاتب محتوى محترف لمنصة لينكدإن.
+أنشئ منشورًا مهنيًا واضحًا يتحدث عن: "{input}"
+- اجعل الفكرة الأساسية واضحة من البداية
+- أضف ثلاث نقاط أو خطوات عملية
+- أنهِ المنشور برسالة ملهمة أو نصيحة
+- استخدم أسلوب بسيط راقٍ
+- لا تضف هاشتاقات
+""",
+            "emojis": ["💼", "📈", "🏆", "🔍", "🚀"],
+        },
+        "إنستغرام": {
+            "model": "meta-llama/llama-4-maverick:free",
+            "max_tokens": 450,
+            "template": """
+أنت صانع محتوى إنستغرام.
+اكتب منشورًا ملهمًا أو تحفيزيًا عن: "{input}"
+- اجعل الأسلوب مشوقًا وعاطفيًا
+- استخدم جمل قصيرة
+- أضف إيموجي معبرة
+- لا تضف هاشتاقات
+""",
+            "emojis": ["❤️", "🌟", "📸", "💫", "🌈"],
+        }
+    }
+
+    if platform not in platform_config:
+        return f"⚠️ المنصة غير مدعومة. الخيارات: {', '.join(platform_config.keys())}"
+
+    cfg = platform_config[platform]
+    style_note = f"\nاكتب باللهجة {dialect} بأسلوب عام.\n{legacy_dialect_examples(dialect)}" if dialect else ""
+    system_prompt = cfg["template"].format(input=user_input) + style_note
+    user_prompt = f"أنشئ منشورًا إبداعيًا. استخدم هذه الإيموجي: {', '.join(random.sample(cfg['emojis'], 3))}"
+
+    request = dict(
+        extra_headers={
+            "HTTP-Referer": SITE_URL,
+            "X-Title": SITE_NAME,
+        },
+        model=cfg["model"],
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.75,
+        max_tokens=cfg["max_tokens"],
+        timeout=30.0
+    )
+
+    cleaned = legacy_clean_content(content)
+    if not cleaned or len(cleaned) < 50:
+        raise ValueError("النص الناتج غير كافٍ")
+
+    if not any(emoji in cleaned for emoji in platform_config[platform]["emojis"]):
+        cleaned = f"{random.choice(platform_config[platform]['emojis'])} {cleaned}"
+    return request, cleaned
+
+
+# ============= القياس =============
+def legacy_request():
+    legacy_generate_request(SAMPLE_INPUT, PLATFORM, DIALECT)
+
+
+def current_request():
+    build_completion_request(SAMPLE_INPUT, PLATFORM, DIALECT)
+    finalize_content(SAMPLE_OUTPUT, PLATFORM)
+
+
+def measure(func):
+    func()
+    seconds = min(timeit.repeat(func, number=ITERATIONS, repeat=3)) / ITERATIONS
+
+    # ذروة الذاكرة المحجوزة أثناء طلب واحد (متوسط عدة طلبات لتخفيف أثر المجمّعات الداخلية)
+    tracemalloc.start()
+    func()
+    peaks = []
+    for _ in range(20):
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - baseline)
+    tracemalloc.stop()
+    return seconds, sum(peaks) // len(peaks)
+
+
+def main():
+    legacy, legacy_cleaned = legacy_generate_request(SAMPLE_INPUT, PLATFORM, DIALECT)
+    current = build_completion_request(SAMPLE_INPUT, PLATFORM, DIALECT)
+    # رسالة النظام والنص النهائي مطابقان حرفيًا (رسالة المستخدم فيها إيموجي عشوائية)
+    assert legacy["messages"][0] == current["messages"][0]
+    assert legacy_cleaned == finalize_content(SAMPLE_OUTPUT, PLATFORM)
+
+    results = {name: measure(func) for name, func in (("before", legacy_request), ("after", current_request))}
+    print(f"{'':8}{'µs/request':>14}{'peak bytes/request':>20}")
+    for name, (seconds, peak) in results.items():
+        print(f"{name:8}{seconds * 1e6:14.2f}{peak:20}")
+    print(f"\nspeedup: {results['before'][0] / results['after'][0]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
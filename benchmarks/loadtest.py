@@ -0,0 +1,333 @@
+"""
+اختبار حِمْل دون اتصال لمسار المحادثة الحقيقي (setup_handlers):
+/start ← /generate ← المنصة ← اللهجة ← الفكرة، لآلاف المستخدمين الاصطناعيين.
+
+كل الأطراف الخارجية محلية:
+- Bot API: طلب HTTP وهمي (BaseRequest) يرد فورًا أو بعد تأخير محدد.
+- OpenRouter: عميل AsyncOpenAI حقيقي فوق httpx.MockTransport بزمن وأخطاء قابلة للضبط.
+- التخزين: مخزن الذاكرة (أو SQLite مؤقت عبر --storage sqlite).
+
+التشغيل من جذر المشروع:
+    python benchmarks/loadtest.py --users 2000 --concurrency 200
+    python benchmarks/loadtest.py --llm-median 1.5 --stall-rate 0.02 --error-rate 0.05
+
+المخرجات: الإنتاجية، والمئينات p50/p95/p99 لكل خطوة، وتأخر حلقة الأحداث.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import Counter
+
+# الإعدادات قبل استيراد وحدات البوت لأنها تقرأ متغيرات البيئة عند الاستيراد
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("OPENROUTER_API_KEY", "loadtest")
+os.environ.setdefault("REQUIRED_CHANNEL", "@loadtest_channel")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("METRICS_PORT", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import main as bot_main  # noqa: E402
+import utils  # noqa: E402
+from storage import set_storage  # noqa: E402
+from storage.memory import MemoryStorage  # noqa: E402
+from storage.sqlite import SQLiteStorage  # noqa: E402
+from services import openai_service, hedging, retry_policy, scheduler, persistence, update_ordering  # noqa: E402
+
+BOT_ID = 1
+USER_ID_BASE = 10_000_000
+STEPS = ("start", "generate", "platform", "dialect", "idea")
+PLATFORMS = ("تويتر", "لينكدإن", "إنستغرام")
+DIALECTS = ("الفصحى المبسطة", "اليمنية", "الخليجية", "المصرية", "الشامية", "المغربية")
+SAMPLE_POST = (
+    "🚀 أطلقنا اليوم خدمتنا الجديدة لتوصيل الطعام في المدينة! "
+    "اطلب وجبتك المفضلة بضغطة زر وسنصلك خلال دقائق.\n"
+    "- سرعة في التوصيل\n- أسعار مناسبة\n- خدمة على مدار الساعة ✨"
+)
+
+
+# ============= Bot API وهمي =============
+class FakeBotRequest(BaseRequest):
+    """يرد على طرق Bot API المستخدمة في البوت بكائنات JSON صالحة دون شبكة"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.failures = 0
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, text, message_id=None):
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "LoadTest"},
+            "text": text,
+        }
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] += 1
+        params = request_data.parameters if request_data else {}
+
+        if name == "getMe":
+            result = {
+                "id": BOT_ID, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot",
+                "can_join_groups": False, "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        elif name in ("sendMessage", "editMessageText"):
+            text = str(params.get("text", ""))
+            if text.startswith("⚠️"):
+                self.failures += 1
+            result = self._message(params.get("chat_id"), text, params.get("message_id"))
+        elif name == "getChatMember":
+            result = {
+                "status": "member",
+                "user": {"id": params.get("user_id"), "is_bot": False, "first_name": "user"},
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# ============= OpenRouter وهمي =============
+class FakeLLM:
+    """نقطة نهاية متوافقة مع OpenAI بزمن لوغاريتمي طبيعي وتوقفات وأخطاء عشوائية"""
+
+    def __init__(self, median: float, sigma: float, stall_rate: float, stall: float,
+                 error_rate: float, rate_limit_rate: float, chunks: int):
+        self.median = median
+        self.sigma = sigma
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.chunks = chunks
+        self.calls = Counter()
+
+    def _latency(self) -> float:
+        if random.random() < self.stall_rate:
+            return self.stall
+        return random.lognormvariate(0, self.sigma) * self.median
+
+    async def _sse(self, model: str, latency: float):
+        words = SAMPLE_POST.split(" ")
+        step = max(1, len(words) // self.chunks)
+        for start in range(0, len(words), step):
+            await asyncio.sleep(latency / self.chunks)
+            chunk = {
+                "id": "chatcmpl-loadtest", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": " ".join(words[start:start + step]) + " "},
+                             "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        model = body["model"]
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.calls["429"] += 1
+            return httpx.Response(429, headers={"retry-after": "1"}, json={"error": {"message": "rate limited"}})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.calls["500"] += 1
+            await asyncio.sleep(self._latency() / 4)
+            return httpx.Response(500, json={"error": {"message": "upstream error"}})
+
+        latency = self._latency()
+        if body.get("stream"):
+            self.calls["stream"] += 1
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  content=self._sse(model, latency))
+
+        self.calls["completion"] += 1
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-loadtest", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": SAMPLE_POST},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 60, "total_tokens": 160},
+        })
+
+
+# ============= المحاكاة =============
+def make_update(update_id: int, user_id: int, text: str, bot) -> Update:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+async def run_user(app, index: int, args, timings: dict, counter):
+    user_id = USER_ID_BASE + index
+    # نسبة من الأفكار مكررة عمدًا لقياس أثر الذاكرة المؤقتة ودمج الطلبات
+    if random.random() < args.duplicate_ratio:
+        idea = f"فكرة مشتركة رقم {index % 10}"
+    else:
+        idea = f"فكرة المستخدم {index} حول إطلاق منتج جديد"
+    texts = ("/start", "/generate", random.choice(PLATFORMS), random.choice(DIALECTS), idea)
+
+    flow_started = time.perf_counter()
+    for step, text in zip(STEPS, texts):
+        started = time.perf_counter()
+        await app.process_update(make_update(next(counter), user_id, text, app.bot))
+        timings[step].append(time.perf_counter() - started)
+    timings["flow"].append(time.perf_counter() - flow_started)
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def report(timings: dict, lag: list, elapsed: float, args, bot_request, llm):
+    flows = len(timings["flow"])
+    print(f"\nusers: {args.users}  concurrency: {args.concurrency}  storage: {args.storage}")
+    print(f"elapsed: {elapsed:.2f}s  throughput: {flows / elapsed:.1f} flows/s, "
+          f"{flows * len(STEPS) / elapsed:.1f} updates/s\n")
+
+    print(f"{'step':10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step in STEPS + ("flow",):
+        values = timings[step]
+        print(f"{step:10}{len(values):8}"
+              + "".join(f"{percentile(values, q) * 1000:10.1f}" for q in (0.5, 0.95, 0.99))
+              + f"{max(values, default=0) * 1000:10.1f}")
+
+    print(f"\nevent loop lag: p50 {percentile(lag, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(lag, 0.99) * 1000:.2f} ms, max {max(lag, default=0) * 1000:.2f} ms")
+    print(f"bot api calls: {dict(bot_request.calls)}")
+    print(f"llm calls: {dict(llm.calls)}")
+    print(f"failed generations shown to users: {bot_request.failures}")
+    print(f"coalescing: {openai_service.flight_stats}  hedging: {hedging.hedge_stats}  "
+          f"retries: {retry_policy.retry_stats}  log sink: {utils.log_sink_stats}  "
+          f"scheduler: {scheduler.scheduler_stats}  persistence: {persistence.persistence_stats}  "
+          f"ordering: {update_ordering.ordering_stats}")
+
+
+async def run(args):
+    if args.storage == "sqlite":
+        set_storage(SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "bot.db")))
+    else:
+        set_storage(MemoryStorage())
+
+    llm = FakeLLM(args.llm_median, args.llm_sigma, args.stall_rate, args.stall,
+                  args.error_rate, args.rate_limit_rate, args.chunks)
+    openai_service.client = AsyncOpenAI(
+        base_url="http://openrouter.loadtest/api/v1",
+        api_key="loadtest",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(llm.handle)),
+    )
+
+    bot_request = FakeBotRequest(args.telegram_latency)
+    builder = (
+        ApplicationBuilder()
+        .token(os.environ["TELEGRAM_BOT_TOKEN"])
+        .request(bot_request)
+        .get_updates_request(FakeBotRequest())
+        .updater(None)
+    )
+    if args.persistence:
+        builder = builder.persistence(persistence.StoragePersistence())
+    # نفس فئة Application التي يبنيها main.py
+    app = update_ordering.configure_concurrency(builder).build()
+    bot_main.setup_handlers(app)
+
+    timings = {step: [] for step in STEPS + ("flow",)}
+    lag = []
+    counter = iter(range(1, 10 ** 9))
+    limiter = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index):
+        async with limiter:
+            await run_user(app, index, args, timings, counter)
+
+    await app.initialize()
+    if args.persistence:
+        # start يشغّل حلقة update_persistence الدورية
+        await app.start()
+    utils.start_log_sink()
+    monitor = asyncio.ensure_future(monitor_loop_lag(lag))
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(limited(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        monitor.cancel()
+        await utils.stop_log_sink()
+        await utils.flush_user_updates_async()
+        if args.persistence:
+            await app.stop()
+        await app.shutdown()
+
+    report(timings, lag, elapsed, args, bot_request, llm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the bot conversation flow")
+    parser.add_argument("--users", type=int, default=1000, help="عدد المستخدمين الاصطناعيين")
+    parser.add_argument("--concurrency", type=int, default=200, help="مستخدمون نشطون في الوقت نفسه")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="زمن كل طلب Bot API بالثواني")
+    parser.add_argument("--llm-median", type=float, default=0.8, help="وسيط زمن التوليد بالثواني")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="تشتت التوزيع اللوغاريتمي الطبيعي")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="نسبة الطلبات المتوقفة")
+    parser.add_argument("--stall", type=float, default=20.0, help="مدة التوقف بالثواني")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="نسبة أخطاء 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="نسبة أخطاء 429")
+    parser.add_argument("--chunks", type=int, default=8, help="عدد دفعات الرد المتدفق")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="نسبة الأفكار المكررة")
+    parser.add_argument("--persistence", action="store_true", help="تفعيل StoragePersistence")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # سجلات البوت تغطي على التقرير؛ التحذيرات والأخطاء فقط
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
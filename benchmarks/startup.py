@@ -0,0 +1,96 @@
+"""
+قياس زمن الإقلاع البارد: استيراد main.py ثم أول إنشاء للمخزن ولعميل OpenRouter.
+
+كل تشغيل في عملية Python جديدة حتى لا تخفي ذاكرة الوحدات المستوردة الكلفة الحقيقية.
+التخزين افتراضيًا في الذاكرة؛ لقياس تهيئة Firebase الحقيقية مرّر --storage firebase
+مع متغيرات FIREBASE_* نفسها التي يستخدمها البوت.
+
+التشغيل من جذر المشروع:
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --importtime 15
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from storage import get_storage
+get_storage()
+storage_ready = time.perf_counter()
+from services.openai_service import get_client
+get_client()
+client_ready = time.perf_counter()
+print(__import__("json").dumps({
+    "import main": imported - started,
+    "first get_storage()": storage_ready - imported,
+    "first get_client()": client_ready - storage_ready,
+}))
+"""
+
+
+def child_env(storage: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:STARTUP")
+    env.setdefault("OPENROUTER_API_KEY", "startup")
+    env.setdefault("METRICS_PORT", "0")
+    env.setdefault("LOG_FILE", "")
+    env["STORAGE_BACKEND"] = storage
+    return env
+
+
+def run_once(env: dict) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(env: dict, top: int):
+    # -X importtime يكتب: self [us] | cumulative [us] | الوحدة
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.split(":", 1)[1].split("|")
+        module = module.strip()
+        # الحزم العليا فقط (الوحدة الفرعية محسوبة ضمن حزمتها)
+        if "." not in module:
+            rows.append((int(cumulative_us), module))
+    print(f"\ntop {top} top-level imports by cumulative time:")
+    for cumulative_us, module in sorted(rows, reverse=True)[:top]:
+        print(f"  {module:30} {cumulative_us / 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start timing of the bot process")
+    parser.add_argument("--runs", type=int, default=5, help="عدد العمليات الجديدة")
+    parser.add_argument("--storage", choices=("memory", "sqlite", "firebase"), default="memory")
+    parser.add_argument("--importtime", type=int, default=0, help="عرض أثقل N وحدات مستوردة")
+    args = parser.parse_args()
+
+    env = child_env(args.storage)
+    samples = [run_once(env) for _ in range(args.runs)]
+    print(f"runs: {args.runs}  storage: {args.storage}")
+    print(f"{'phase':24}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in samples[0]:
+        values = [sample[phase] * 1000 for sample in samples]
+        print(f"{phase:24}{statistics.median(values):12.1f}{min(values):10.1f}{max(values):10.1f}")
+
+    if args.importtime:
+        import_profile(env, args.importtime)
+
+
+if __name__ == "__main__":
+    main()
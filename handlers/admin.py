@@ -2,12 +2,18 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, CallbackContext
 from config import ADMIN_IDS
 from utils import (
-    get_all_users, get_all_logs, reset_user_counts,
-    clear_all_logs, get_daily_new_users, get_platform_usage
+    get_stats_async, rebuild_stats_async, reset_user_counts_async,
+    clear_all_logs_async, save_broadcast_state_async, get_post_counts_by_day_async
 )
 import logging
+import asyncio
+import time
 from datetime import date
 from telegram.constants import ParseMode
+from services.response_cache import get_cache_stats
+from services.model_router import get_model_stats
+from services.metrics import timed_handler
+from services.broadcast import start_broadcast as launch_broadcast
 
 # إعداد المسجل (logger)
 logger = logging.getLogger(__name__)
@@ -34,6 +40,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("📊 الإحصائيات الكاملة", callback_data="view_statistics")],
         [InlineKeyboardButton("🔄 تصفير العدادات", callback_data="reset_counts_confirm")],
         [InlineKeyboardButton("🗑️ حذف جميع السجلات", callback_data="clear_logs_confirm")],
+        [InlineKeyboardButton("🛠️ إعادة بناء الإحصائيات", callback_data="rebuild_stats_confirm")],
         [InlineKeyboardButton("📢 إرسال إشعار عام", callback_data="broadcast_message")]
     ])
 
@@ -60,24 +67,29 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
         await handle_reset_counts(query, action)
     elif action.startswith("clear_logs"):
         await handle_clear_logs(query, action)
+    elif action.startswith("rebuild_stats"):
+        await handle_rebuild_stats(query, action)
     elif action == "broadcast_message":
         await start_broadcast(query, context)
 
+@timed_handler("show_statistics")
 async def show_statistics(query):
     try:
-        users = get_all_users()
-        logs = get_all_logs()
-        
-        total_users = len(users)
-        total_posts = sum(len(user_logs) for user_logs in logs.values()) if logs else 0
-        new_users = get_daily_new_users()
-        platform_stats = get_platform_usage()
+        stats, daily_posts = await asyncio.gather(
+            get_stats_async(),
+            get_post_counts_by_day_async(7)
+        )
+        total_users = stats["total_users"]
+        total_posts = stats["total_posts"]
+        new_users = stats["new_users_today"]
+        platform_stats = stats["platforms"]
 
         stats_text = [
             "📈 *الإحصائيات العامة:*",
             f"👥 *إجمالي المستخدمين:* {total_users}",
             f"📝 *إجمالي المنشورات:* {total_posts}",
             f"🆕 *مستخدمين جدد اليوم:* {new_users}",
+            f"📅 *منشورات آخر 7 أيام:* {sum(daily_posts.values())}",
             "",
             "🏆 *أكثر المنصات استخدامًا:*"
         ]
@@ -89,6 +101,24 @@ async def show_statistics(query):
         else:
             stats_text.append("لا توجد بيانات متاحة")
 
+        cache = get_cache_stats()
+        cache_hits = cache["hits"] + cache["persistent_hits"]
+        cache_total = cache_hits + cache["misses"]
+        hit_rate = escape_markdown(f"{cache['hit_rate']:.0%}")
+        stats_text.extend([
+            "",
+            f"⚡ *ذاكرة المنشورات:* {hit_rate} إصابة \\({cache_hits}/{cache_total}\\)"
+        ])
+
+        models = get_model_stats()
+        if models:
+            stats_text.extend(["", "🤖 *حالة النماذج:*"])
+            for m in models:
+                latency = f"{m['latency']:.1f}s" if m["latency"] is not None else "-"
+                stats_text.append(escape_markdown(
+                    f"{m['model']}: {m['state']}, {latency}, أخطاء {m['error_rate']:.0%}"
+                ))
+
         await query.edit_message_text(
             "\n".join(stats_text),
             parse_mode=ParseMode.MARKDOWN_V2
@@ -110,7 +140,7 @@ async def handle_reset_counts(query, action):
             parse_mode=ParseMode.MARKDOWN_V2
         )
     elif action == "reset_counts_execute":
-        reset_user_counts()
+        await reset_user_counts_async()
         await query.edit_message_text("✅ تم تصفير العدادات بنجاح", parse_mode=ParseMode.MARKDOWN_V2)
     elif action == "reset_counts_cancel":
         await query.edit_message_text("❌ تم إلغاء العملية", parse_mode=ParseMode.MARKDOWN_V2)
@@ -128,11 +158,29 @@ async def handle_clear_logs(query, action):
             parse_mode=ParseMode.MARKDOWN_V2
         )
     elif action == "clear_logs_execute":
-        clear_all_logs()
+        await clear_all_logs_async()
         await query.edit_message_text("✅ تم حذف السجلات بنجاح", parse_mode=ParseMode.MARKDOWN_V2)
     elif action == "clear_logs_cancel":
         await query.edit_message_text("❌ تم إلغاء العملية", parse_mode=ParseMode.MARKDOWN_V2)
 
+async def handle_rebuild_stats(query, action):
+    if action == "rebuild_stats_confirm":
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ نعم، تأكيد", callback_data="rebuild_stats_execute")],
+            [InlineKeyboardButton("❌ إلغاء", callback_data="rebuild_stats_cancel")]
+        ])
+        await query.edit_message_text(
+            "⚠ *تأكيد العملية*"
+            "\nإعادة البناء تقرأ قاعدة البيانات كاملة، هل تريد المتابعة\?",
+            reply_markup=keyboard,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+    elif action == "rebuild_stats_execute":
+        await rebuild_stats_async()
+        await query.edit_message_text("✅ تمت إعادة بناء الإحصائيات بنجاح", parse_mode=ParseMode.MARKDOWN_V2)
+    elif action == "rebuild_stats_cancel":
+        await query.edit_message_text("❌ تم إلغاء العملية", parse_mode=ParseMode.MARKDOWN_V2)
+
 async def start_broadcast(query, context):
     context.user_data['awaiting_broadcast'] = True
     await query.edit_message_text(
@@ -151,24 +199,19 @@ async def receive_broadcast_message(update: Update, context: CallbackContext):
         return
 
     message = update.message.text
-    users = get_all_users().keys()
-
-    success = 0
-    failed = 0
+    context.user_data.pop('awaiting_broadcast', None)
     progress_msg = await update.message.reply_text("⏳ جاري الإرسال\.\.\.", parse_mode=ParseMode.MARKDOWN_V2)
 
-    for uid in users:
-        try:
-            await context.bot.send_message(uid, message)
-            success += 1
-        except Exception as e:
-            logger.error(f"Failed to send to {uid}: {e}")
-            failed += 1
-
-    context.user_data.pop('awaiting_broadcast', None)
-    await progress_msg.edit_text(
-        "✅ *تم إرسال الإشعار*"
-        f"\n• تم بنجاح: {success}"
-        f"\n• فشل الإرسال: {failed}",
-        parse_mode=ParseMode.MARKDOWN_V2
-    )
+    # الإرسال يتم في الخلفية حتى لا تتعطل معالجة تحديثات المشرف
+    broadcast_id = f"{int(time.time())}_{user_id}"
+    state = {
+        "text": message,
+        "admin_chat_id": progress_msg.chat_id,
+        "progress_message_id": progress_msg.message_id,
+        "status": "running",
+        "sent": 0,
+        "failed": 0,
+        "blocked": 0
+    }
+    await save_broadcast_state_async(broadcast_id, state)
+    launch_broadcast(context.application, broadcast_id, state)
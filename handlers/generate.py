@@ -1,10 +1,17 @@
 import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from telegram import Update, ReplyKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
 from services.openai_service import generate_response
+from services.metrics import timed_handler
+from services.scheduler import generation_slot, GenerationRejected, GENERATION_QUEUE_LIMIT
+from services.job_queue import GENERATION_MODE, get_job_queue
 from utils import (
-    increment_user_count, require_subscription,
-    get_user_data, log_post, has_reached_limit
+    require_subscription, log_post_async, run_db,
+    get_quota_remaining_async, try_consume_quota_async, refund_quota_async
 )
 
 PLATFORM_CHOICE, DIALECT_CHOICE, EVENT_DETAILS = range(3)
@@ -18,20 +25,83 @@ DAILY_LIMIT = 5
 
 ADMIN_IDS = [int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip().isdigit()]
 
+# عرض المنشور تدريجيًا أثناء التوليد بتعديل رسالة الانتظار نفسها
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+# أقل فاصل (بالثواني) بين تعديلين متتاليين للرسالة احترامًا لحدود Telegram
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+BUSY_TEXT = "⚠️ الخدمة مزدحمة حاليًا، يرجى المحاولة بعد قليل."
+
+logger = logging.getLogger(__name__)
+
+async def safe_edit(msg, text) -> bool:
+    try:
+        await msg.edit_text(text[:TELEGRAM_MESSAGE_LIMIT])
+        return True
+    except TelegramError as e:
+        # مثل "Message is not modified" أو RetryAfter: نتخطى هذا التعديل فقط
+        logger.debug(f"Skipped message edit: {e}")
+        return False
+
+def make_progress_editor(msg):
+    loop = asyncio.get_running_loop()
+    state = {"last_edit": 0.0, "shown": ""}
+
+    async def on_progress(text):
+        now = loop.time()
+        preview = text.strip()
+        if preview and preview != state["shown"] and now - state["last_edit"] >= STREAM_EDIT_INTERVAL:
+            state["shown"] = preview
+            state["last_edit"] = now
+            await safe_edit(msg, f"{preview} ▌")
+
+    return on_progress
+
+def remaining_message(remaining) -> str:
+    if remaining == 0:
+        return "⚠️ لقد استنفدت جميع طلباتك لليوم."
+    return f"✅ تبقى لديك {remaining} من {DAILY_LIMIT} لهذا اليوم."
+
+async def _consume_quota(update: Update, user_id: int, is_admin: bool, notice_msg=None) -> tuple:
+    """يعيد (مسموح، المتبقي) ويبلغ المستخدم إن انتهت حصته"""
+    if is_admin:
+        return True, "غير محدود"
+    allowed, remaining = await try_consume_quota_async(user_id, DAILY_LIMIT)
+    if not allowed:
+        text = "⚠️ لقد وصلت للحد الأقصى من الطلبات اليوم."
+        if notice_msg is None or not await safe_edit(notice_msg, text):
+            await update.message.reply_text(text)
+    return allowed, remaining
+
+def make_admission(user_id: int, msg):
+    """مقعد التوليد للطلب القائد فقط؛ ترتيب الانتظار يظهر في رسالة التقدم نفسها"""
+    @asynccontextmanager
+    async def admission():
+        state = {"waited": False}
+
+        async def on_position(position):
+            state["waited"] = True
+            await safe_edit(msg, f"⏳ طلبك في قائمة الانتظار، ترتيبك: {position}")
+
+        async with generation_slot(user_id, on_position=on_position):
+            if state["waited"]:
+                await safe_edit(msg, "⏳ يتم إنشاء المنشور...")
+            yield
+
+    return admission
+
 @require_subscription
 async def generate_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     is_admin = user_id in ADMIN_IDS
 
     if not is_admin:
-        if has_reached_limit(user_id, DAILY_LIMIT):
+        remaining = await get_quota_remaining_async(user_id, DAILY_LIMIT)
+        if remaining <= 0:
             await update.message.reply_text("⚠️ لقد وصلت للحد الأقصى من الطلبات اليوم.")
             return ConversationHandler.END
 
-        data = get_user_data(user_id)
-        count = data.get("count", 0)
-        remaining = max(0, DAILY_LIMIT - count)
-
         await update.message.reply_text(
             f"📱 اختر المنصة:\n\nلديك {remaining} من {DAILY_LIMIT} طلبات متبقية اليوم.",
             reply_markup=ReplyKeyboardMarkup([SUPPORTED_PLATFORMS], one_time_keyboard=True, resize_keyboard=True)
@@ -75,6 +145,7 @@ async def dialect_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("✍️ أرسل الآن فكرة المنشور أو نصه:")
     return EVENT_DETAILS
 
+@timed_handler("event_details")
 @require_subscription
 async def event_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -87,30 +158,73 @@ async def event_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ حدث خطأ في تحديد المنصة أو اللهجة. يرجى البدء من جديد.")
         return ConversationHandler.END
 
-    if not is_admin:
-        if has_reached_limit(user_id, DAILY_LIMIT):
-            await update.message.reply_text("⚠️ لقد وصلت للحد الأقصى من الطلبات اليوم.")
-            return ConversationHandler.END
-        increment_user_count(user_id)
-        data = get_user_data(user_id)
-        remaining = max(0, DAILY_LIMIT - data.get("count", 0))
-    else:
-        remaining = "غير محدود"
+    if GENERATION_MODE == "queue":
+        return await _enqueue_generation(update, user_id, is_admin, platform, dialect, user_input)
 
-    msg = await update.message.reply_text("⏳ يتم إنشاء المنشور...")
+    return await _generate_and_reply(update, context, user_id, is_admin, platform, dialect, user_input)
 
+async def _enqueue_generation(update, user_id, is_admin, platform, dialect, user_input):
+    """وضع الطابور: تُضاف المهمة ويتولى worker.py التوليد والرد"""
+    queue = get_job_queue()
+    if await run_db(queue.pending_count) >= GENERATION_QUEUE_LIMIT:
+        await update.message.reply_text(BUSY_TEXT)
+        return ConversationHandler.END
+
+    allowed, remaining = await _consume_quota(update, user_id, is_admin)
+    if not allowed:
+        return ConversationHandler.END
+
+    msg = await update.message.reply_text("⏳ تمت إضافة طلبك إلى قائمة الانتظار...")
     try:
-        result = generate_response(user_input, platform, dialect)
-        log_post(user_id, platform, result)
+        await run_db(queue.enqueue, {
+            "user_id": user_id,
+            "chat_id": msg.chat_id,
+            "message_id": msg.message_id,
+            "platform": platform,
+            "dialect": dialect,
+            "user_input": user_input,
+            "remaining": None if is_admin else remaining
+        })
+    except Exception:
+        await safe_edit(msg, "⚠️ حدث خطأ أثناء إنشاء المنشور. حاول مجددًا.")
+        raise
+    return ConversationHandler.END
 
-        await context.bot.delete_message(chat_id=msg.chat.id, message_id=msg.message_id)
-        await update.message.reply_text(result)
+async def _generate_and_reply(update, context, user_id, is_admin, platform, dialect, user_input):
+    allowed, remaining = await _consume_quota(update, user_id, is_admin)
+    if not allowed:
+        return ConversationHandler.END
+
+    msg = await update.message.reply_text("⏳ يتم إنشاء المنشور...")
+    # المقعد يُحجز داخل generate_response للطلب الذي يستدعي OpenRouter فقط؛
+    # الرد من الذاكرة المؤقتة أو الانضمام لطلب مطابق لا ينتظر الطابور ولا يُرفض
+    admission = make_admission(user_id, msg)
 
-        if not is_admin:
-            if remaining == 0:
-                await update.message.reply_text("⚠️ لقد استنفدت جميع طلباتك لليوم.")
-            else:
-                await update.message.reply_text(f"✅ تبقى لديك {remaining} من {DAILY_LIMIT} لهذا اليوم.")
+    try:
+        if STREAMING_ENABLED:
+            result = await generate_response(
+                user_input, platform, dialect, on_progress=make_progress_editor(msg), admission=admission
+            )
+            await log_post_async(user_id, platform, result)
+
+            if not await safe_edit(msg, result):
+                await update.message.reply_text(result)
+        else:
+            result = await generate_response(user_input, platform, dialect, admission=admission)
+            await log_post_async(user_id, platform, result)
+
+            await context.bot.delete_message(chat_id=msg.chat.id, message_id=msg.message_id)
+            await update.message.reply_text(result)
+
+        if not is_admin and remaining is not None:
+            await update.message.reply_text(remaining_message(remaining))
+    except GenerationRejected:
+        # رُفض قبل التوليد: لا يخسر المستخدم طلبًا من حصته
+        if not is_admin and remaining is not None:
+            await refund_quota_async(user_id)
+        if not await safe_edit(msg, BUSY_TEXT):
+            await update.message.reply_text(BUSY_TEXT)
+        return ConversationHandler.END
     except Exception as e:
         await context.bot.delete_message(chat_id=msg.chat.id, message_id=msg.message_id)
         await update.message.reply_text("⚠️ حدث خطأ أثناء إنشاء المنشور. حاول مجددًا.")
@@ -1,14 +1,18 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, CallbackContext
-from config import CHANNEL_USERNAME, CHANNEL_LINK
-from utils import get_user_data, save_user_data
+from config import CHANNEL_LINK
+from utils import (
+    get_user_data_async, save_user_data_async,
+    is_user_subscribed, REQUIRED_CHANNEL
+)
 from datetime import datetime, date
 import logging
 from telegram.constants import ParseMode
+from services.metrics import timed_handler
 
 logger = logging.getLogger(__name__)
 
-clean_channel_username = CHANNEL_USERNAME.replace("@", "")
+clean_channel_username = REQUIRED_CHANNEL.replace("@", "")
 
 def html_escape(text):
     return (
@@ -17,18 +21,6 @@ def html_escape(text):
             .replace(">", "&gt;")
     )
 
-async def check_subscription(update: Update, context: CallbackContext) -> bool:
-    user = update.effective_user
-    try:
-        member = await context.bot.get_chat_member(
-            chat_id=f"@{clean_channel_username}", 
-            user_id=user.id
-        )
-        return member.status in ["member", "administrator", "creator"]
-    except Exception as e:
-        logger.error(f"Subscription check failed for {user.id}: {e}")
-        return False
-
 async def send_subscription_prompt(update: Update, context: CallbackContext):
     keyboard = InlineKeyboardMarkup([
         [
@@ -57,7 +49,8 @@ async def check_subscription_callback(update: Update, context: CallbackContext):
     await query.answer()
     
     try:
-        if await check_subscription(update, context):
+        # المستخدم يطلب إعادة التحقق صراحةً، لذا نتجاهل النتيجة المخزنة
+        if await is_user_subscribed(query.from_user.id, context, use_cache=False):
             success_msg = (
                 "🎉 <b>تم التحقق بنجاح!</b>\n\n"
                 "يمكنك الآن استخدام جميع ميزات البوت:\n"
@@ -86,27 +79,26 @@ async def check_subscription_callback(update: Update, context: CallbackContext):
             parse_mode=ParseMode.HTML
         )
 
+@timed_handler("start_handler")
 async def start_handler(update: Update, context: CallbackContext):
     user = update.effective_user
 
     try:
-        existing_data = get_user_data(user.id)
+        existing_data = await get_user_data_async(user.id)
 
-        updated_data = {
+        # تُكتب الحقول المتغيرة فقط وبشكل مؤجل (انظر flush_user_updates)
+        await save_user_data_async(user.id, {
             "first_name": user.first_name or "",
             "username": user.username or "",
             "date": existing_data.get("date") or str(date.today()),
-            "count": existing_data.get("count", 0),
             "last_active": str(datetime.utcnow())
-        }
-
-        save_user_data(user.id, updated_data)
+        })
 
     except Exception as e:
         logger.error(f"Failed to register/update user {user.id}: {e}")
 
     try:
-        if not await check_subscription(update, context):
+        if not await is_user_subscribed(user.id, context):
             await send_subscription_prompt(update, context)
             return
 
@@ -1,5 +1,7 @@
 import logging
 import os
+# أول استيراد حتى يشمل تقرير الإقلاع زمن استيراد بقية الوحدات
+from services.startup import mark, startup_report, prewarm, PREWARM_ENABLED
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, CallbackQueryHandler,
@@ -14,10 +16,23 @@ from handlers.generate import (
 from handlers.admin import (
     admin_panel, handle_admin_actions, receive_broadcast_message
 )
+from utils import (
+    flush_user_updates_async, USER_FLUSH_INTERVAL, start_log_sink, stop_log_sink,
+    prune_old_logs_async, LOG_RETENTION_DAYS, LOG_PRUNE_INTERVAL
+)
+from services.broadcast import resume_broadcasts, stop_broadcasts
+from services.metrics import InstrumentedRequest, start_metrics_server
+from services.persistence import StoragePersistence, PERSISTENCE_ENABLED
+from services.update_ordering import configure_concurrency
 
+# ملف السجل يُفتح عند أول سجل لا عند الإقلاع (LOG_FILE فارغ للتعطيل)
+LOG_FILE = os.getenv("LOG_FILE", "bot_errors.log")
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=logging.INFO,
+    handlers=[logging.StreamHandler()] + (
+        [logging.FileHandler(LOG_FILE, encoding='utf-8', delay=True)] if LOG_FILE else []
+    )
 )
 logger = logging.getLogger(__name__)
 
@@ -27,6 +42,35 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     if update and hasattr(update, 'message'):
         await update.message.reply_text("⚠️ حدث خطأ غير متوقع. الرجاء المحاولة لاحقًا.")
 
+async def flush_pending_writes(context: ContextTypes.DEFAULT_TYPE):
+    await flush_user_updates_async()
+
+async def prune_logs_job(context: ContextTypes.DEFAULT_TYPE):
+    # الحذف على دفعات صغيرة حتى لا يتحول إلى طلب حذف ضخم واحد
+    for _ in range(10):
+        if not await prune_old_logs_async(LOG_RETENTION_DAYS):
+            break
+
+async def warm_up_job(context: ContextTypes.DEFAULT_TYPE):
+    # يعمل بعد ربط الـ webhook: أول وصول للمخزن (وتهيئة Firebase) لا يؤخر بدء الاستقبال
+    mark("serving")
+    await resume_broadcasts(context.application)
+    if PREWARM_ENABLED:
+        await prewarm()
+    logger.info(f"Startup: {startup_report()}")
+
+async def on_startup(app):
+    start_metrics_server()
+    start_log_sink()
+    mark("initialized")
+
+async def on_shutdown(app):
+    await stop_broadcasts()
+    logs = await stop_log_sink()
+    logger.info(f"Flushed {logs} queued post logs on shutdown")
+    flushed = await flush_user_updates_async()
+    logger.info(f"Flushed {flushed} pending user records on shutdown")
+
 def setup_handlers(app):
     app.add_handler(CommandHandler("start", start_handler))
     app.add_handler(CallbackQueryHandler(check_subscription_callback, pattern="^check_subscription$"))
@@ -39,21 +83,42 @@ def setup_handlers(app):
             EVENT_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, event_details)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="generate_conversation",
+        persistent=isinstance(app.persistence, StoragePersistence)
     )
     app.add_handler(conv_handler)
+    if isinstance(app.persistence, StoragePersistence):
+        app.persistence.install(app, conv_handler)
 
     app.add_handler(CommandHandler("admin", admin_panel))
-    app.add_handler(CallbackQueryHandler(handle_admin_actions, pattern="^(view_statistics|reset_counts_|clear_logs_|broadcast_)"))
+    app.add_handler(CallbackQueryHandler(handle_admin_actions, pattern="^(view_statistics|reset_counts_|clear_logs_|rebuild_stats_|broadcast_)"))
     app.add_handler(MessageHandler(filters.TEXT & filters.User(ADMIN_IDS), receive_broadcast_message))
 
 def main():
+    mark("imports")
     if not TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN is missing or not set in environment variables.")
 
-    app = ApplicationBuilder().token(TOKEN).build()
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        # نفس أحجام المجمّعات الافتراضية في ApplicationBuilder مع قياس زمن كل طلب
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if PERSISTENCE_ENABLED:
+        builder = builder.persistence(StoragePersistence())
+    builder = configure_concurrency(builder)
+    app = builder.build()
     setup_handlers(app)
     app.add_error_handler(error_handler)
+    app.job_queue.run_once(warm_up_job, when=0)
+    app.job_queue.run_repeating(flush_pending_writes, interval=USER_FLUSH_INTERVAL, first=USER_FLUSH_INTERVAL)
+    if LOG_RETENTION_DAYS > 0:
+        app.job_queue.run_repeating(prune_logs_job, interval=LOG_PRUNE_INTERVAL, first=60)
 
     if os.getenv("RENDER"):
         webhook_url = "https://bassam-hammeed-bot.onrender.com/"
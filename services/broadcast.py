@@ -0,0 +1,195 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError, TelegramError
+from utils import (
+    get_broadcast_recipients_async, mark_users_blocked_async,
+    save_broadcast_state_async, get_active_broadcasts_async, transact_broadcast_async
+)
+
+logger = logging.getLogger(__name__)
+
+# حدود Telegram: قرابة 30 رسالة/ثانية للبوت كله ورسالة واحدة/ثانية لكل محادثة.
+# كل مستخدم يستلم رسالة واحدة فقط في الإشعار، لذا يكفي الحد العام مع احترام RetryAfter.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "200"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# عقد الملكية: يُجدَّد بعد كل دفعة، وإن انقضى (توقفت العملية المالكة) تستأنفه عملية أخرى
+BROADCAST_LEASE_SECONDS = float(os.getenv("BROADCAST_LEASE_SECONDS", "120"))
+
+# معرّف هذه العملية كمالكة للإشعارات (عدة نسخ من البوت قد تستأنف الإشعار نفسه)
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# "chat not found" ليس حظرًا دائمًا فيُعد فشلًا عاديًا
+_BLOCKED_ERRORS = ("user is deactivated", "bot was blocked")
+
+class BroadcastNotOwned(Exception):
+    """الإشعار لم يعد قيد التشغيل أو تملكه عملية أخرى بعقد سارٍ"""
+
+def _claim(progress: dict = None):
+    """دالة معاملة تحجز الإشعار لهذه العملية وتحفظ التقدم معه"""
+    def claim(current):
+        now = time.time()
+        if not current or current.get("status") != "running":
+            raise BroadcastNotOwned()
+        if current.get("owner") not in (None, OWNER_ID) and current.get("lease_until", 0) > now:
+            raise BroadcastNotOwned()
+        current.update(progress or {})
+        current["owner"] = OWNER_ID
+        current["lease_until"] = now + BROADCAST_LEASE_SECONDS
+        return current
+    return claim
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # بعد RetryAfter يتوقف الإرسال كله وليس الطلب الذي فشل فقط
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+async def send_with_retries(bot, bucket: TokenBucket, chat_id: int, text: str) -> str:
+    for attempt in range(BROADCAST_MAX_RETRIES):
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id, text)
+            return "sent"
+        except RetryAfter as e:
+            logger.warning(f"Broadcast throttled by Telegram for {e.retry_after}s")
+            bucket.pause(e.retry_after)
+        except Forbidden:
+            return "blocked"
+        except BadRequest as e:
+            if any(reason in str(e).lower() for reason in _BLOCKED_ERRORS):
+                return "blocked"
+            logger.error(f"Failed to send to {chat_id}: {e}")
+            return "failed"
+        except (TimedOut, NetworkError) as e:
+            logger.warning(f"Transient error sending to {chat_id}: {e}")
+            await asyncio.sleep(2 ** attempt)
+        except TelegramError as e:
+            logger.error(f"Failed to send to {chat_id}: {e}")
+            return "failed"
+    return "failed"
+
+def format_progress(state: dict) -> str:
+    done = state.get("sent", 0) + state.get("failed", 0) + state.get("blocked", 0)
+    return (
+        f"⏳ جاري الإرسال: {done}/{state.get('total', 0)}"
+        f"\n• تم بنجاح: {state.get('sent', 0)}"
+        f"\n• فشل الإرسال: {state.get('failed', 0)}"
+        f"\n• حظروا البوت: {state.get('blocked', 0)}"
+    )
+
+async def _edit_progress(bot, state: dict, text: str):
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=state["admin_chat_id"],
+            message_id=state["progress_message_id"]
+        )
+    except TelegramError as e:
+        logger.debug(f"Skipped broadcast progress edit: {e}")
+
+async def run_broadcast(bot, broadcast_id: str, state: dict):
+    """يرسل الإشعار على دفعات ويحفظ موضع التقدم بعد كل دفعة ليمكن استئنافه"""
+    # الحجز قبل أي إرسال؛ الحالة المحفوظة (موضع التقدم والعدادات) هي المرجع
+    state = await transact_broadcast_async(broadcast_id, _claim())
+    bucket = TokenBucket(BROADCAST_RATE)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    recipients = await get_broadcast_recipients_async(state.get("cursor"))
+    if not state.get("total"):
+        state["total"] = len(recipients)
+    last_progress = 0.0
+
+    async def deliver(uid):
+        async with semaphore:
+            return uid, await send_with_retries(bot, bucket, uid, state["text"])
+
+    try:
+        for start in range(0, len(recipients), BROADCAST_BATCH_SIZE):
+            batch = recipients[start:start + BROADCAST_BATCH_SIZE]
+            results = await asyncio.gather(*(deliver(uid) for uid in batch))
+
+            blocked = [uid for uid, outcome in results if outcome == "blocked"]
+            for _, outcome in results:
+                state[outcome] = state.get(outcome, 0) + 1
+            state["cursor"] = batch[-1]
+
+            await mark_users_blocked_async(blocked)
+            # يجدد العقد؛ BroadcastNotOwned إن انتقلت الملكية فيتوقف الإرسال هنا
+            state = await transact_broadcast_async(broadcast_id, _claim(state))
+
+            if time.monotonic() - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+                await _edit_progress(bot, state, format_progress(state))
+                last_progress = time.monotonic()
+    except asyncio.CancelledError:
+        # الإيقاف أثناء الإرسال: تبقى الحالة "running" ويُحرَّر العقد لتستأنفه أي نسخة فورًا
+        logger.info(f"Broadcast {broadcast_id} interrupted at cursor {state.get('cursor')}")
+        await save_broadcast_state_async(broadcast_id, {"lease_until": 0})
+        raise
+
+    state = await transact_broadcast_async(broadcast_id, _claim(dict(state, status="done")))
+    await _edit_progress(
+        bot, state,
+        "✅ تم إرسال الإشعار"
+        f"\n• تم بنجاح: {state.get('sent', 0)}"
+        f"\n• فشل الإرسال: {state.get('failed', 0)}"
+        f"\n• حظروا البوت: {state.get('blocked', 0)}"
+    )
+    logger.info(f"Broadcast {broadcast_id} finished: {state}")
+
+async def _run_guarded(bot, broadcast_id: str, state: dict):
+    """لا يموت الإشعار بصمت: الخطأ يُسجَّل وتصبح الحالة failed بدل running إلى الأبد"""
+    try:
+        await run_broadcast(bot, broadcast_id, state)
+    except BroadcastNotOwned:
+        logger.info(f"Broadcast {broadcast_id} is owned by another process or no longer running")
+    except Exception as e:
+        logger.exception(f"Broadcast {broadcast_id} failed: {e}")
+        await save_broadcast_state_async(broadcast_id, {"status": "failed", "error": str(e)[:200]})
+        await _edit_progress(bot, state, "❌ توقف الإشعار بسبب خطأ. راجع السجلات.")
+
+_running_broadcasts = set()
+
+def start_broadcast(application, broadcast_id: str, state: dict):
+    # لا نستخدم application.create_task لأن إيقاف التطبيق ينتظر مهامه حتى تكتمل
+    task = asyncio.get_running_loop().create_task(_run_guarded(application.bot, broadcast_id, state))
+    _running_broadcasts.add(task)
+    task.add_done_callback(_running_broadcasts.discard)
+    return task
+
+async def stop_broadcasts():
+    for task in list(_running_broadcasts):
+        task.cancel()
+    await asyncio.gather(*_running_broadcasts, return_exceptions=True)
+
+async def resume_broadcasts(application):
+    for broadcast_id, state in (await get_active_broadcasts_async()).items():
+        logger.info(f"Resuming broadcast {broadcast_id} after cursor {state.get('cursor')}")
+        start_broadcast(application, broadcast_id, state)
@@ -0,0 +1,97 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# ============= الطلبات الاحتياطية (hedging) =============
+# إن لم يصل رد بعد تأخير متكيف (المئين p90 للطلبات الأخيرة) يُرسل طلب ثانٍ
+# ويُؤخذ أول رد ناجح ويُلغى الآخر. النسبة محدودة حتى تبقى التكلفة مضبوطة
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+# التأخير قبل توفر عينات كافية، وحدّاه الأدنى والأعلى بالثواني
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "20"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# أقصى نسبة من الطلبات الأخيرة يُسمح بتحوّطها
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+_latencies = {}
+_recent_hedges = deque(maxlen=HEDGE_WINDOW)
+hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+def record_latency(key: str, seconds: float):
+    samples = _latencies.get(key)
+    if samples is None:
+        samples = _latencies[key] = deque(maxlen=HEDGE_WINDOW)
+    samples.append(seconds)
+
+def hedge_delay(key: str) -> float:
+    samples = _latencies.get(key)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    ordered = sorted(samples)
+    delay = ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, delay))
+
+def _allow_hedge() -> bool:
+    # طلب واحد على الأقل مسموح حتى تمتلئ النافذة
+    return sum(_recent_hedges) < max(1, HEDGE_MAX_RATE * len(_recent_hedges))
+
+async def _cancel(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def run_hedged(key: str, make_primary, make_hedge, discard=None):
+    """يشغّل make_primary() ويطلق make_hedge() إن تأخر الرد؛ يعيد أول نتيجة ناجحة
+
+    discard(نتيجة) تُستدعى لكل نتيجة ناجحة لم تُختر (مثل تدفق مفتوح يجب إغلاقه).
+    """
+    started = time.monotonic()
+    primary = asyncio.ensure_future(make_primary())
+    if not HEDGE_ENABLED:
+        result = await primary
+        record_latency(key, time.monotonic() - started)
+        return result
+
+    hedge_stats["requests"] += 1
+    tasks = [primary]
+    winner = None
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=hedge_delay(key))
+        hedged = not done and _allow_hedge()
+        _recent_hedges.append(hedged)
+        if hedged:
+            hedge_stats["hedged"] += 1
+            logger.info(f"Hedging slow request for {key} after {time.monotonic() - started:.1f}s")
+            tasks.append(asyncio.ensure_future(make_hedge()))
+            pending.add(tasks[-1])
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    if task is not primary:
+                        hedge_stats["hedge_wins"] += 1
+                    record_latency(key, time.monotonic() - started)
+                    return task.result()
+                # خطأ الطلب الأساسي أولى بالإبلاغ من خطأ الطلب الاحتياطي
+                if task is primary or error is None:
+                    error = task.exception()
+        raise error
+    finally:
+        if pending:
+            await _cancel(pending)
+        if discard is not None:
+            # الخاسر قد يكتمل بنجاح في الجولة نفسها أو قبل أن يصله الإلغاء
+            for task in tasks:
+                if task is not winner and task.done() and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# ============= طابور مهام التوليد =============
+# inline: التوليد داخل عملية البوت (الافتراضي) | queue: البوت يضيف مهمة وworker.py ينفذها
+GENERATION_MODE = os.getenv("GENERATION_MODE", "inline").strip().lower()
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.db")
+# مهلة حجز المهمة: إن توقف العامل دون إنهائها تعود للطابور بعد انقضائها
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_claim ON generation_jobs (status, lease_until, job_id);
+"""
+
+class SQLiteJobQueue:
+    """طابور مهام بملف SQLite (وضع WAL) تتشاركه عملية البوت وعمليات العمال على الجهاز نفسه"""
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def enqueue(self, payload: dict) -> int:
+        with self._write() as conn:
+            cursor = conn.execute(
+                "INSERT INTO generation_jobs (payload, created_at) VALUES (?, ?)",
+                (json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            return cursor.lastrowid
+
+    def claim(self):
+        """يحجز أقدم مهمة منتظرة (أو منتهية المهلة) ويعيد (job_id, payload, attempts) أو None"""
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT job_id, payload, attempts FROM generation_jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY job_id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts = row
+            conn.execute(
+                "UPDATE generation_jobs SET status = 'running', attempts = attempts + 1, lease_until = ? "
+                "WHERE job_id = ?",
+                (now + JOB_LEASE_SECONDS, job_id)
+            )
+        return job_id, json.loads(payload), attempts + 1
+
+    def release(self, job_id: int):
+        """يعيد المهمة للطابور فورًا بعد فشل قابل لإعادة المحاولة"""
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE generation_jobs SET status = 'queued', lease_until = 0 WHERE job_id = ?", (job_id,)
+            )
+
+    def complete(self, job_id: int):
+        with self._write() as conn:
+            conn.execute("DELETE FROM generation_jobs WHERE job_id = ?", (job_id,))
+
+    def pending_count(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> SQLiteJobQueue:
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = SQLiteJobQueue()
+    return _job_queue
@@ -0,0 +1,127 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from functools import wraps
+from prometheus_client import Histogram, start_http_server, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# منفذ جانبي لواجهة /metrics (0 للتعطيل)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "0.0.0.0")
+
+# ============= المقاييس =============
+OPENROUTER_SECONDS = Histogram(
+    "bot_openrouter_request_seconds", "OpenRouter completion latency",
+    ["model", "platform", "outcome"],
+    buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60)
+)
+STORAGE_SECONDS = Histogram(
+    "bot_storage_operation_seconds", "Storage operation latency by utils function",
+    ["operation", "outcome"]
+)
+TELEGRAM_SECONDS = Histogram(
+    "bot_telegram_request_seconds", "Telegram Bot API request latency",
+    ["method", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Update handler duration",
+    ["handler", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+)
+
+@contextmanager
+def observe(histogram, **labels):
+    """يقيس مدة الكتلة ويضيف outcome=success/error/cancelled للوسوم"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    except BaseException as e:
+        if not isinstance(e, Exception):
+            outcome = "cancelled"
+        raise
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - started)
+
+def timed_handler(name: str):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with observe(HANDLER_SECONDS, handler=name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest يسجل زمن كل طلب نحو Bot API حسب اسم الدالة"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        with observe(TELEGRAM_SECONDS, method=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+# ============= أعماق الطوابير ونسب الإصابة =============
+class _RuntimeCollector:
+    """يقرأ عدادات الوحدات الحالية عند كل طلب /metrics بدل نسخها عند كل تغيير"""
+
+    def describe(self):
+        # بلا وصف مسبق حتى لا يُستدعى collect (واستيراداته) لحظة التسجيل
+        return []
+
+    def collect(self):
+        # الاستيراد هنا لتفادي الاستيراد الدائري (utils يستورد هذه الوحدة)
+        import utils
+        from services import (
+            openai_service, response_cache, hedging, retry_policy, broadcast, scheduler,
+            persistence, update_ordering, startup
+        )
+
+        depth = GaugeMetricFamily("bot_queue_depth", "Items waiting in in-process queues", labels=["queue"])
+        depth.add_metric(["post_logs"], utils.get_log_queue_depth())
+        depth.add_metric(["dirty_users"], len(utils._dirty_users))
+        depth.add_metric(["inflight_generations"], len(openai_service._inflight))
+        depth.add_metric(["generation_queue"], scheduler.get_queue_length())
+        depth.add_metric(["active_generations"], scheduler.get_active_generations())
+        depth.add_metric(["broadcasts"], len(broadcast._running_broadcasts))
+        yield depth
+
+        hit_rate = GaugeMetricFamily("bot_cache_hit_ratio", "Cache hit ratio since start", labels=["cache"])
+        hit_rate.add_metric(["responses"], response_cache.get_cache_stats()["hit_rate"])
+        subs = utils.subscription_cache_stats
+        hit_rate.add_metric(["subscriptions"], subs["hits"] / max(1, subs["hits"] + subs["misses"]))
+        yield hit_rate
+
+        events = GaugeMetricFamily("bot_events", "Cumulative in-process event counters", labels=["source", "event"])
+        for source, stats in (
+            ("log_sink", utils.log_sink_stats),
+            ("coalescing", openai_service.flight_stats),
+            ("hedging", hedging.hedge_stats),
+            ("retries", retry_policy.retry_stats),
+            ("scheduler", scheduler.scheduler_stats),
+            ("persistence", persistence.persistence_stats),
+            ("update_ordering", update_ordering.ordering_stats),
+        ):
+            for event, value in stats.items():
+                events.add_metric([source, event], value)
+        yield events
+
+        phases = GaugeMetricFamily("bot_startup_seconds", "Seconds from import to each startup phase", labels=["phase"])
+        for phase, seconds in startup.get_startup_phases().items():
+            phases.add_metric([phase], seconds)
+        yield phases
+
+_server_started = False
+
+def start_metrics_server():
+    global _server_started
+    if _server_started or METRICS_PORT <= 0:
+        return
+    REGISTRY.register(_RuntimeCollector())
+    start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+    _server_started = True
+    logger.info(f"Metrics available on :{METRICS_PORT}/metrics")
@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+import logging
+import statistics
+from collections import deque
+from contextlib import contextmanager
+from types import MappingProxyType
+from services.metrics import OPENROUTER_SECONDS, observe
+
+logger = logging.getLogger(__name__)
+
+# ============= مجموعات النماذج =============
+# قائمة مرتبة حسب الأفضلية مفصولة بفواصل، مثال:
+#   MODEL_POOL="meta-llama/llama-4-maverick:free,deepseek/deepseek-chat-v3-0324:free"
+# ويمكن تخصيص منصة بعينها عبر MODEL_POOL_TWITTER / MODEL_POOL_LINKEDIN / MODEL_POOL_INSTAGRAM
+def _parse_pool(value: str) -> tuple:
+    return tuple(model.strip() for model in value.split(",") if model.strip())
+
+MODEL_POOL = _parse_pool(os.getenv("MODEL_POOL", ""))
+_PLATFORM_POOL_ENV = MappingProxyType({
+    "تويتر": "MODEL_POOL_TWITTER",
+    "لينكدإن": "MODEL_POOL_LINKEDIN",
+    "إنستغرام": "MODEL_POOL_INSTAGRAM",
+})
+MODEL_POOLS = MappingProxyType({
+    platform: _parse_pool(os.getenv(env, "")) or MODEL_POOL
+    for platform, env in _PLATFORM_POOL_ENV.items()
+})
+
+# ============= إعدادات الصحة وقاطع الدائرة =============
+MODEL_HEALTH_WINDOW = int(os.getenv("MODEL_HEALTH_WINDOW", "50"))
+# يُفتح القاطع بعد عدد من الإخفاقات المتتالية أو عند تجاوز نسبة الأخطاء في النافذة
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_MIN_SAMPLES = int(os.getenv("CIRCUIT_MIN_SAMPLES", "10"))
+# مدة الفتح الأولى بالثواني، تتضاعف عند فشل طلب الاختبار حتى الحد الأقصى
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+CIRCUIT_MAX_COOLDOWN = float(os.getenv("CIRCUIT_MAX_COOLDOWN", "600"))
+# طلب اختبار لم يُبلَّغ عن نتيجته خلال هذه المدة يُعد منتهيًا (أُلغي المستدعي قبل track مثلًا)
+CIRCUIT_PROBE_TIMEOUT = float(os.getenv("CIRCUIT_PROBE_TIMEOUT", "120"))
+# ثوانٍ تُضاف لكل مرتبة في القائمة حتى يبقى الترتيب مفضلًا عند تقارب الأداء
+ROUTER_ORDER_PENALTY = float(os.getenv("ROUTER_ORDER_PENALTY", "1.0"))
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", "4.0"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class ModelHealth:
+    """زمن الاستجابة ونسبة الأخطاء لنموذج واحد مع حالة قاطع الدائرة"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.samples = deque(maxlen=MODEL_HEALTH_WINDOW)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = CIRCUIT_COOLDOWN
+        self.probe_in_flight = False
+        self.probe_started = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for ok, _ in self.samples if not ok) / len(self.samples)
+
+    @property
+    def latency(self):
+        latencies = [latency for ok, latency in self.samples if ok]
+        return statistics.median(latencies) if latencies else None
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            # انتهت مدة الفتح: يُسمح بطلب اختبار واحد
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == HALF_OPEN:
+            if self.probe_in_flight and now - self.probe_started >= CIRCUIT_PROBE_TIMEOUT:
+                logger.warning(f"Probe for {self.model} expired without a result, allowing another")
+                self.probe_in_flight = False
+            return not self.probe_in_flight
+        return self.state == CLOSED
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        logger.warning(f"Circuit opened for {self.model} for {self.cooldown:.0f}s (error rate {self.error_rate:.0%})")
+
+    def record(self, ok: bool, latency: float, now: float):
+        self.samples.append((ok, latency))
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = False
+            if ok:
+                self.state = CLOSED
+                self.cooldown = CIRCUIT_COOLDOWN
+                self.consecutive_failures = 0
+                logger.info(f"Circuit closed for {self.model}")
+            else:
+                self.cooldown = min(self.cooldown * 2, CIRCUIT_MAX_COOLDOWN)
+                self._open(now)
+            return
+
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.state == CLOSED and (
+            self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD
+            or (len(self.samples) >= CIRCUIT_MIN_SAMPLES and self.error_rate >= CIRCUIT_ERROR_RATE)
+        ):
+            self._open(now)
+
+    def snapshot(self) -> dict:
+        return {
+            "model": self.model,
+            "state": self.state,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "samples": len(self.samples),
+        }
+
+_health = {}
+
+def _get_health(model: str) -> ModelHealth:
+    health = _health.get(model)
+    if health is None:
+        health = _health[model] = ModelHealth(model)
+    return health
+
+def get_pool(platform: str, default_model: str) -> tuple:
+    return MODEL_POOLS.get(platform) or MODEL_POOL or (default_model,)
+
+def choose_model(platform: str, default_model: str, exclude=()) -> str:
+    """أفضل نموذج متاح للمنصة: أقل (زمن × عقوبة الأخطاء + عقوبة الترتيب)"""
+    pool = get_pool(platform, default_model)
+    candidates = [model for model in pool if model not in exclude] or list(pool)
+    now = time.monotonic()
+    healths = [_get_health(model) for model in candidates]
+
+    available = [(i, h) for i, h in enumerate(healths) if h.available(now)]
+    if not available:
+        # كل القواطع مفتوحة: نجرب النموذج الذي ينتهي فتحه أولًا بدل رفض الطلب
+        return min(healths, key=lambda h: h.opened_at + h.cooldown).model
+
+    known = [h.latency for _, h in available if h.latency is not None]
+    # النموذج بلا قياسات يُقدَّر بوسيط المتاحين حتى لا يتقدم أو يتأخر بلا سبب
+    default_latency = statistics.median(known) if known else 0.0
+
+    def score(item):
+        i, health = item
+        latency = health.latency if health.latency is not None else default_latency
+        return latency * (1 + ROUTER_ERROR_PENALTY * health.error_rate) + i * ROUTER_ORDER_PENALTY
+
+    _, chosen = min(available, key=score)
+    if chosen.state == HALF_OPEN:
+        chosen.probe_in_flight = True
+        chosen.probe_started = now
+    return chosen.model
+
+@contextmanager
+def track(model: str, platform: str = ""):
+    """يقيس استدعاءً واحدًا للنموذج ويسجل نجاحه أو فشله"""
+    health = _get_health(model)
+    started = time.monotonic()
+    try:
+        with observe(OPENROUTER_SECONDS, model=model, platform=platform):
+            yield
+    except (asyncio.CancelledError, GeneratorExit):
+        # الإلغاء أو إغلاق التدفق مبكرًا ليس عطلًا في النموذج، لكن يجب تحرير طلب الاختبار
+        health.probe_in_flight = False
+        raise
+    except Exception:
+        health.record(False, time.monotonic() - started, time.monotonic())
+        raise
+    health.record(True, time.monotonic() - started, time.monotonic())
+
+def get_model_stats() -> list:
+    return [health.snapshot() for health in _health.values()]
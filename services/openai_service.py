@@ -2,47 +2,86 @@ import re
 import logging
 import os
 import random
-from openai import OpenAI
-
-# إعدادات التسجيل
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot_errors.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import asyncio
+import httpx
+from functools import partial, lru_cache
+from contextlib import AsyncExitStack
+from types import MappingProxyType
+from openai import AsyncOpenAI, DEFAULT_TIMEOUT
+from services.response_cache import get_cached_response, store_response, make_cache_key
+from services.model_router import choose_model, track
+from services.hedging import run_hedged
+from services.retry_policy import GENERATION_DEADLINE, retry_budget, next_retry_delay
 
 API_KEY = os.getenv('OPENROUTER_API_KEY')
-if not API_KEY:
-    logging.error("OPENROUTER_API_KEY غير موجود في متغيرات البيئة")
 
 SITE_URL = os.getenv('SITE_URL', 'https://your-site.com')
 SITE_NAME = os.getenv('SITE_NAME', 'My Bot')
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=API_KEY,
-)
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# مدة بقاء الاتصال الخامل في المجمّع؛ أطول من 5 ثوانٍ الافتراضية في httpx حتى يفيد التسخين المسبق
+OPENROUTER_KEEPALIVE = float(os.getenv('OPENROUTER_KEEPALIVE', '60'))
+
+# يُنشأ العميل عند أول استخدام لا عند الاستيراد (يمكن للاختبارات تعيين client مباشرة)
+client = None
+_http_client = None
+
+def get_client() -> AsyncOpenAI:
+    global client, _http_client
+    if client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=OPENROUTER_KEEPALIVE),
+            follow_redirects=True
+        )
+        client = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=API_KEY,
+            # إعادة المحاولة تتم في retry_policy فقط حتى لا تتضاعف داخل مكتبة openai
+            max_retries=0,
+            http_client=_http_client,
+        )
+    return client
+
+async def prewarm_connection() -> bool:
+    """ينشئ العميل ويفتح اتصال TLS نحو OpenRouter مسبقًا ليعيد أول توليد استخدامه"""
+    if not API_KEY:
+        logging.error("OPENROUTER_API_KEY غير موجود في متغيرات البيئة")
+        return False
+    get_client()
+    if _http_client is None:
+        return False
+    # أي رد يكفي: المهم أن يبقى الاتصال في المجمّع
+    await _http_client.head(OPENROUTER_BASE_URL, timeout=10)
+    return True
+
+# لا حد تزامن هنا: المستدعي هو من يقبل التوليد (scheduler.GENERATION_SLOTS في البوت،
+# WORKER_CONCURRENCY في worker.py)، والطلبات الاحتياطية محدودة بـ HEDGE_MAX_RATE
+async def create_completion(platform="", **kwargs):
+    with track(kwargs["model"], platform):
+        return await get_client().chat.completions.create(**kwargs)
+
+# أنماط التنظيف تُترجم مرة واحدة عند الاستيراد
+_ARABIC_CHARS = r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]'
+_ALLOWED_SYMBOLS = r'[!؟.,،؛:\n\-#@_ ]'
+_EMOJIS = r'[\U0001F300-\U0001F6FF\u2600-\u26FF\u2700-\u27BF]'
+_DISALLOWED_RE = re.compile(fr'[^\n{_ARABIC_CHARS}{_ALLOWED_SYMBOLS}{_EMOJIS}]')
+_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+_EXTRA_SPACES_RE = re.compile(r'[ ]{2,}')
 
 def clean_content(text):
     if not text:
         return ""
     try:
-        arabic_chars = r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]'
-        allowed_symbols = r'[!؟.,،؛:\n\-#@_ ]'
-        emojis = r'[\U0001F300-\U0001F6FF\u2600-\u26FF\u2700-\u27BF]'
-        cleaned = re.sub(fr'[^\n{arabic_chars}{allowed_symbols}{emojis}]', '', str(text))
-        cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
-        cleaned = re.sub(r'[ ]{2,}', ' ', cleaned)
+        cleaned = _DISALLOWED_RE.sub('', str(text))
+        cleaned = _EXTRA_NEWLINES_RE.sub('\n\n', cleaned)
+        cleaned = _EXTRA_SPACES_RE.sub(' ', cleaned)
         return cleaned.strip()
     except Exception as e:
         logging.error(f"خطأ في تنظيف النص: {str(e)}")
         return str(text)[:500]
 
-def dialect_examples(dialect):
-    examples = {
+DIALECT_EXAMPLES = MappingProxyType({
         "المغربية": """\
 - استعمل كلمات مثل: "واخّا"، "بزاف"، "دابا"، "خويا"، "نعيقو"، "زعما"، "خاي"، "عفاك"، "مزيان"، "حاجة زوينة"
 - اكتب باللهجة المغربية بأسلوب عام يناسب المنشورات العامة.
@@ -73,20 +112,18 @@ def dialect_examples(dialect):
 - تجنب صيغة السوالف أو المجالس.
 - أدرج الكلمات في سياق الجمل بشكل منطقي طبيعي.
 """
-    }
-    return examples.get(dialect, "")
+})
 
-def generate_twitter_post(user_input, dialect=None):
-    try:
-        style_note = f"\nاكتب باللهجة {dialect} بأسلوب راقٍ يناسب منشور عام.\n{dialect_examples(dialect)}" if dialect else ""
-        response = client.chat.completions.create(
-            extra_headers={
-                "HTTP-Referer": SITE_URL,
-                "X-Title": SITE_NAME,
-            },
-            model="meta-llama/llama-4-maverick:free",
-            messages=[
-                {"role": "system", "content": f"""
+def dialect_examples(dialect):
+    return DIALECT_EXAMPLES.get(dialect, "")
+
+PLATFORM_CONFIG = MappingProxyType({
+    "تويتر": MappingProxyType({
+        "model": "meta-llama/llama-4-maverick:free",
+        "max_tokens": 300,
+        "temperature": 0.7,
+        "timeout": 25.0,
+        "template": """
 أنت كاتب محتوى عربي محترف لمنصات التواصل.
 - أنشئ تغريدة جذابة حول الفكرة التالية.
 - استخدم أسلوبًا بسيطًا وواضحًا وراقيًا.
@@ -94,28 +131,16 @@ def generate_twitter_post(user_input, dialect=None):
 - لا تستخدم هاشتاقات.
 - أضف إيموجي معبّرة حسب السياق.
 {style_note}
-""" },
-                {"role": "user", "content": user_input}
-            ],
-            temperature=0.7,
-            max_tokens=300,
-            timeout=25.0
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        logging.error(f"خطأ في إنشاء تغريدة: {str(e)}")
-        return None
-
-def generate_response(user_input, platform, dialect=None, max_retries=None):
-    platform_config = {
-        "تويتر": {
-            "generator": generate_twitter_post,
-            "emojis": ["🔥", "💡", "🚀", "✨", "🎯"],
-        },
-        "لينكدإن": {
-            "model": "meta-llama/llama-4-maverick:free",
-            "max_tokens": 600,
-            "template": """
+""",
+        "style_note": "\nاكتب باللهجة {dialect} بأسلوب راقٍ يناسب منشور عام.\n{examples}",
+        "emojis": ("🔥", "💡", "🚀", "✨", "🎯"),
+    }),
+    "لينكدإن": MappingProxyType({
+        "model": "meta-llama/llama-4-maverick:free",
+        "max_tokens": 600,
+        "temperature": 0.75,
+        "timeout": 30.0,
+        "template": """
 أنت كاتب محتوى محترف لمنصة لينكدإن.
 أنشئ منشورًا مهنيًا واضحًا يتحدث عن: "{input}"
 - اجعل الفكرة الأساسية واضحة من البداية
@@ -123,77 +148,267 @@ def generate_response(user_input, platform, dialect=None, max_retries=None):
 - أنهِ المنشور برسالة ملهمة أو نصيحة
 - استخدم أسلوب بسيط راقٍ
 - لا تضف هاشتاقات
-""",
-            "emojis": ["💼", "📈", "🏆", "🔍", "🚀"],
-        },
-        "إنستغرام": {
-            "model": "meta-llama/llama-4-maverick:free",
-            "max_tokens": 450,
-            "template": """
+{style_note}""",
+        "style_note": "\nاكتب باللهجة {dialect} بأسلوب عام.\n{examples}",
+        "emojis": ("💼", "📈", "🏆", "🔍", "🚀"),
+    }),
+    "إنستغرام": MappingProxyType({
+        "model": "meta-llama/llama-4-maverick:free",
+        "max_tokens": 450,
+        "temperature": 0.75,
+        "timeout": 30.0,
+        "template": """
 أنت صانع محتوى إنستغرام.
 اكتب منشورًا ملهمًا أو تحفيزيًا عن: "{input}"
 - اجعل الأسلوب مشوقًا وعاطفيًا
 - استخدم جمل قصيرة
 - أضف إيموجي معبرة
 - لا تضف هاشتاقات
-""",
-            "emojis": ["❤️", "🌟", "📸", "💫", "🌈"],
-        }
+{style_note}""",
+        "style_note": "\nاكتب باللهجة {dialect} بأسلوب عام.\n{examples}",
+        "emojis": ("❤️", "🌟", "📸", "💫", "🌈"),
+    }),
+})
+
+_EXTRA_HEADERS = MappingProxyType({
+    "HTTP-Referer": SITE_URL,
+    "X-Title": SITE_NAME,
+})
+
+@lru_cache(maxsize=128)
+def system_prompt_parts(platform, dialect=None):
+    """يبني موجّه النظام لكل (منصة، لهجة) مرة واحدة ويعيده مقسومًا حول موضع الفكرة"""
+    cfg = PLATFORM_CONFIG[platform]
+    style_note = cfg["style_note"].format(dialect=dialect, examples=dialect_examples(dialect)) if dialect else ""
+    # استبدال نصي بدل format حتى لا تتأثر الأقواس داخل أمثلة اللهجات
+    prompt = cfg["template"].replace("{style_note}", style_note)
+    prefix, _, suffix = prompt.partition("{input}")
+    return prefix, suffix
+
+def build_completion_request(user_input, platform, dialect=None, model=None):
+    cfg = PLATFORM_CONFIG[platform]
+    prefix, suffix = system_prompt_parts(platform, dialect)
+
+    if platform == "تويتر":
+        messages = [
+            {"role": "system", "content": prefix},
+            {"role": "user", "content": user_input}
+        ]
+    else:
+        user_prompt = f"أنشئ منشورًا إبداعيًا. استخدم هذه الإيموجي: {', '.join(random.sample(cfg['emojis'], 3))}"
+        messages = [
+            {"role": "system", "content": f"{prefix}{user_input}{suffix}"},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    return {
+        "extra_headers": _EXTRA_HEADERS,
+        "model": model or cfg["model"],
+        "messages": messages,
+        "temperature": cfg["temperature"],
+        "max_tokens": cfg["max_tokens"],
+        "timeout": cfg["timeout"]
     }
 
-    if not API_KEY:
-        return "⚠️ يرجى التحقق من إعدادات النظام (مفتاح API مفقود)"
+def finalize_content(content, platform):
+    emojis = PLATFORM_CONFIG[platform]["emojis"]
+    cleaned = clean_content(content)
+    if not cleaned or len(cleaned) < 50:
+        raise ValueError("النص الناتج غير كافٍ")
+
+    if not any(emoji in cleaned for emoji in emojis):
+        cleaned = f"{random.choice(emojis)} {cleaned}"
+    return cleaned
+
+async def hedged_completion(user_input, platform, dialect, model, tried):
+    """طلب إكمال مع طلب احتياطي لنموذج بديل (أو النموذج نفسه) إن تأخر الرد"""
+    def primary():
+        return create_completion(platform, **build_completion_request(user_input, platform, dialect, model))
+
+    def hedge():
+        alternate = choose_model(platform, PLATFORM_CONFIG[platform]["model"], exclude=tried | {model})
+        tried.add(alternate)
+        return create_completion(platform, **build_completion_request(user_input, platform, dialect, alternate))
 
-    if platform not in platform_config:
-        return f"⚠️ المنصة غير مدعومة. الخيارات: {', '.join(platform_config.keys())}"
+    return await run_hedged(platform, primary, hedge)
 
+async def _iter_deltas(stream):
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+async def _open_stream(platform, request):
+    """يفتح التدفق وينتظر أول دفعة نصية؛ يعيد (stack, الدفعات التالية, النص الأول)
+
+    stack يحمل قياس النموذج وإغلاق الاتصال حتى نهاية التدفق.
+    """
+    stack = AsyncExitStack()
     try:
-        max_retries = int(max_retries)
-    except (TypeError, ValueError):
-        max_retries = 3
+        stack.enter_context(track(request["model"], platform))
+        stream = await get_client().chat.completions.create(stream=True, **request)
+        stack.push_async_callback(stream.close)
+        deltas = _iter_deltas(stream)
+        try:
+            first = await deltas.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        return stack, deltas, first
+    except BaseException as e:
+        # الاستثناء يمر إلى track فيُسجَّل فشلًا (أو يُحرَّر المسبار عند الإلغاء)
+        await stack.__aexit__(type(e), e, e.__traceback__)
+        raise
+
+async def _close_stream(opened):
+    stack, _, _ = opened
+    await stack.aclose()
+
+async def stream_response(user_input, platform, dialect=None):
+    """يطلب المنشور كتدفق ويعيد النص الخام المتراكم بعد كل دفعة
+
+    بداية التدفق محمية بطلب احتياطي: إن لم تصل أول دفعة خلال hedge_delay يُفتح تدفق
+    لنموذج بديل ويُكمل أول تدفق يبدأ ويُغلق الآخر.
+    """
+    default_model = PLATFORM_CONFIG[platform]["model"]
+    model = choose_model(platform, default_model)
+    tried = {model}
+
+    def primary():
+        return _open_stream(platform, build_completion_request(user_input, platform, dialect, model))
+
+    def hedge():
+        alternate = choose_model(platform, default_model, exclude=tried)
+        tried.add(alternate)
+        return _open_stream(platform, build_completion_request(user_input, platform, dialect, alternate))
+
+    stack, deltas, text = await run_hedged(f"{platform}:stream", primary, hedge, discard=_close_stream)
+    async with stack:
+        if text:
+            yield text
+        async for delta in deltas:
+            text += delta
+            yield text
 
+async def stream_with_progress(user_input, platform, dialect=None, on_progress=None):
+    text = ""
+    async for text in stream_response(user_input, platform, dialect):
+        if on_progress:
+            await on_progress(text)
+    # التنظيف يتم مرة واحدة على النص النهائي
+    return finalize_content(text, platform)
+
+async def _generate_with_retries(user_input, platform, dialect, max_retries, deadline):
+    loop = asyncio.get_running_loop()
+    tried = set()
     for attempt in range(max_retries):
         try:
-            logging.info(f"جاري إنشاء منشور لـ {platform} - المحاولة {attempt + 1}")
+            # كل محاولة تذهب لأفضل نموذج متاح لم يُجرَّب بعد في هذا الطلب
+            model = choose_model(platform, PLATFORM_CONFIG[platform]["model"], exclude=tried)
+            tried.add(model)
+            logging.info(f"جاري إنشاء منشور لـ {platform} عبر {model} - المحاولة {attempt + 1}")
 
-            if platform == "تويتر":
-                content = platform_config[platform]["generator"](user_input, dialect)
-                if not content:
-                    raise ValueError("فشل إنشاء التغريدة")
-            else:
-                cfg = platform_config[platform]
-                style_note = f"\nاكتب باللهجة {dialect} بأسلوب عام.\n{dialect_examples(dialect)}" if dialect else ""
-                system_prompt = cfg["template"].format(input=user_input) + style_note
-                user_prompt = f"أنشئ منشورًا إبداعيًا. استخدم هذه الإيموجي: {', '.join(random.sample(cfg['emojis'], 3))}"
-
-                response = client.chat.completions.create(
-                    extra_headers={
-                        "HTTP-Referer": SITE_URL,
-                        "X-Title": SITE_NAME,
-                    },
-                    model=cfg["model"],
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.75,
-                    max_tokens=cfg["max_tokens"],
-                    timeout=30.0
-                )
-                content = response.choices[0].message.content
-
-            cleaned = clean_content(content)
-            if not cleaned or len(cleaned) < 50:
-                raise ValueError("النص الناتج غير كافٍ")
-
-            if not any(emoji in cleaned for emoji in platform_config[platform]["emojis"]):
-                cleaned = f"{random.choice(platform_config[platform]['emojis'])} {cleaned}"
+            # المحاولة لا تتجاوز ما تبقى من المهلة الكلية للطلب
+            response = await asyncio.wait_for(
+                hedged_completion(user_input, platform, dialect, model, tried),
+                max(0.0, deadline - loop.time())
+            )
+            content = response.choices[0].message.content
+            if not content:
+                raise ValueError("فشل إنشاء المنشور")
 
+            cleaned = finalize_content(content, platform)
             logging.info("تم إنشاء المنشور بنجاح")
             return cleaned
 
         except Exception as e:
-            logging.error(f"خطأ في المحاولة {attempt + 1}: {str(e)}")
-            continue
+            logging.error(f"خطأ في المحاولة {attempt + 1}: {type(e).__name__}: {str(e)}")
+            if attempt + 1 >= max_retries:
+                break
+            delay = next_retry_delay(e, attempt, deadline)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+    return None
+
+async def _produce(user_input, platform, dialect, max_retries, on_progress):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + GENERATION_DEADLINE
+    retry_budget.record_request()
+    result = None
+    if on_progress:
+        try:
+            result = await asyncio.wait_for(
+                stream_with_progress(user_input, platform, dialect, on_progress),
+                GENERATION_DEADLINE
+            )
+        except Exception as e:
+            logging.warning(f"فشل التوليد المتدفق: {type(e).__name__}: {str(e)}")
+            # الرجوع إلى الطريقة العادية إعادةُ محاولة تخضع للتصنيف والميزانية
+            delay = next_retry_delay(e, 0, deadline)
+            if delay is None:
+                max_retries = 0
+            else:
+                await asyncio.sleep(delay)
+
+    if result is None and max_retries > 0:
+        result = await _generate_with_retries(user_input, platform, dialect, max_retries, deadline)
+    if result is None:
+        return "⚠️ فشل إنشاء المنشور. يرجى:\n- التأكد من الاتصال\n- المحاولة لاحقًا"
+
+    await store_response(user_input, platform, dialect, result)
+    return result
+
+# ============= دمج الطلبات المتطابقة =============
+# الطلبات المتزامنة لنفس (الفكرة، المنصة، اللهجة) تنتظر استدعاءً واحدًا نحو OpenRouter
+_inflight = {}
+flight_stats = {"leaders": 0, "coalesced": 0}
+
+def _finish_flight(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+
+async def _lead(admission, user_input, platform, dialect, max_retries, on_progress):
+    # المقعد يُحجز داخل مهمة القائد: الطلب مسجل في _inflight أثناء انتظاره فتنضم إليه المطابقات
+    if admission is None:
+        return await _produce(user_input, platform, dialect, max_retries, on_progress)
+    async with admission():
+        return await _produce(user_input, platform, dialect, max_retries, on_progress)
+
+async def generate_response(user_input, platform, dialect=None, max_retries=None, use_cache=True, on_progress=None,
+                            admission=None):
+    """admission: مدير سياق (مثل scheduler.generation_slot) يُحجز فقط إن كان هذا الطلب سيستدعي OpenRouter
+
+    الرد من الذاكرة المؤقتة أو الانضمام لطلب مطابق قيد التنفيذ لا يحجز مقعدًا. استثناء الحجز
+    (GenerationRejected) يصل إلى القائد وإلى من انضم إليه.
+    """
+    if not API_KEY:
+        return "⚠️ يرجى التحقق من إعدادات النظام (مفتاح API مفقود)"
+
+    if platform not in PLATFORM_CONFIG:
+        return f"⚠️ المنصة غير مدعومة. الخيارات: {', '.join(PLATFORM_CONFIG.keys())}"
+
+    if use_cache:
+        cached = await get_cached_response(user_input, platform, dialect)
+        if cached is not None:
+            logging.info("تم استخدام منشور من الذاكرة المؤقتة")
+            return cached
+
+    try:
+        max_retries = int(max_retries)
+    except (TypeError, ValueError):
+        max_retries = 3
+
+    key = make_cache_key(user_input, platform, dialect)
+    task = _inflight.get(key)
+    if task is not None:
+        flight_stats["coalesced"] += 1
+        logging.info(f"دمج طلب مطابق لطلب قيد التنفيذ لـ {platform}")
+    else:
+        flight_stats["leaders"] += 1
+        task = asyncio.ensure_future(_lead(admission, user_input, platform, dialect, max_retries, on_progress))
+        _inflight[key] = task
+        task.add_done_callback(partial(_finish_flight, key))
 
-    return "⚠️ فشل إنشاء المنشور. يرجى:\n- التأكد من الاتصال\n- المحاولة لاحقًا"
+    # shield: إلغاء أحد المنتظرين لا يلغي الطلب المشترك على البقية
+    return await asyncio.shield(task)
@@ -0,0 +1,244 @@
+import os
+import copy
+import asyncio
+import uuid
+import logging
+from cachetools import LRUCache
+from telegram import Update
+from telegram.ext import BasePersistence, PersistenceInput, TypeHandler
+from storage import get_storage
+from utils import run_db
+
+logger = logging.getLogger(__name__)
+
+# ============= حفظ حالة المحادثات =============
+# user_data وحالات ConversationHandler في مخزن البيانات المشترك، فتنجو من إعادة النشر
+# ويمكن تشغيل أكثر من نسخة webhook خلف موزّع الحمل.
+# اختياري (PERSISTENCE_ENABLED=1): يضيف قراءة من المخزن لكل تحديث، ولا حاجة له مع نسخة
+# واحدة إلا لحفظ المحادثات الجارية عبر إعادة التشغيل (ومعه PERSISTENCE_SINGLE_REPLICA=1)
+PERSISTENCE_ENABLED = os.getenv("PERSISTENCE_ENABLED", "0") == "1"
+# كل كم ثانية يسلّم PTB التغييرات إلى update_*، ثم تُجمع كلها في كتابة واحدة بعد مهلة قصيرة
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "1"))
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "0.25"))
+# إعادة محاولة الكتابة الفاشلة بعد هذه المهلة دون انتظار تغيير جديد
+PERSISTENCE_RETRY_DELAY = float(os.getenv("PERSISTENCE_RETRY_DELAY", "2"))
+# نسخة واحدة فقط: النسخة المحلية لا يغيّرها غيرنا فلا حاجة لقراءة المخزن بعد أول تحميل
+PERSISTENCE_SINGLE_REPLICA = os.getenv("PERSISTENCE_SINGLE_REPLICA", "0") == "1"
+PERSISTENCE_LOCAL_SIZE = int(os.getenv("PERSISTENCE_LOCAL_SIZE", "50000"))
+
+USER_DATA_FIELD = "user_data"
+# رمز آخر كاتب "{replica_id}:{seq}": يكشف أن نسخة أخرى غيّرت حالة المستخدم بعدنا
+WRITER_FIELD = "_writer"
+
+persistence_stats = {"loads": 0, "local_hits": 0, "load_errors": 0, "flushes": 0, "flush_errors": 0}
+
+def _conversation_prefix(name: str) -> str:
+    return f"conv:{name}:"
+
+def _conversation_field(name: str, key: tuple) -> str:
+    return _conversation_prefix(name) + ":".join(str(part) for part in key)
+
+def _parse_key(raw: str) -> tuple:
+    return tuple(int(part) if part.lstrip("-").isdigit() else part for part in raw.split(":"))
+
+async def _load_state_trigger(update: Update, context):
+    # لا عمل هنا: مطابقة كل تحديث في المجموعة -1 تجعل PTB يستدعي refresh_user_data
+    # قبل أن يقرأ ConversationHandler حالته في المجموعة 0
+    return None
+
+class StoragePersistence(BasePersistence):
+    """BasePersistence فوق get_storage(): تحميل كسول لكل مستخدم وكتابات مجمّعة ومؤجلة
+
+    التخطيط: bot_state/{user_id}/user_data و bot_state/{user_id}/conv:{name}:{key}
+    لا تُحمّل البيانات كلها عند الإقلاع؛ تُقرأ حالة المستخدم (قراءة سجل واحد) عند كل تحديث منه،
+    ولا تُطبّق إلا إن كتبتها نسخة أخرى بعد آخر ما رأيناه، فتبقى تغييرات هذه النسخة التي
+    لم يسلّمها PTB بعد كما هي.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._handlers = []
+        # user_id -> {field: value} بانتظار الكتابة، و_flushing الدفعة الجارية كتابتها
+        self._pending = {}
+        self._flushing = {}
+        self._flush_task = None
+        self._flush_lock = None
+        self._replica_id = uuid.uuid4().hex[:12]
+        self._write_seq = 0
+        # user_id -> رمز الكاتب الذي حُمّلت منه نسخته المحلية أو كتبناه نحن
+        self._seen = LRUCache(maxsize=PERSISTENCE_LOCAL_SIZE)
+        # user_id -> {(name, key)} مفاتيح المحادثات المعروفة محليًا لذلك المستخدم
+        self._conversation_keys = {}
+
+    def install(self, application, *conversation_handlers):
+        """يسجل المحادثات المحفوظة ويضيف مشغّل التحميل في المجموعة -1"""
+        for handler in conversation_handlers:
+            if not (handler.persistent and handler.name) or not handler.per_user or handler.per_message:
+                raise ValueError(f"{handler.name}: StoragePersistence needs persistent per-user conversations")
+            self._handlers.append(handler)
+        application.add_handler(TypeHandler(Update, _load_state_trigger), group=-1)
+
+    # ============= التحميل الكسول =============
+    def _overlay(self, user_id: int, state: dict) -> dict:
+        # ما لم يُكتب بعد أحدث مما في المخزن
+        for source in (self._flushing, self._pending):
+            for field, value in source.get(user_id, {}).items():
+                if value is None:
+                    state.pop(field, None)
+                else:
+                    state[field] = copy.deepcopy(value)
+        return state
+
+    def _apply_conversations(self, user_id: int, state: dict):
+        known = self._conversation_keys.setdefault(user_id, set())
+        for handler in self._handlers:
+            prefix = _conversation_prefix(handler.name)
+            stored = {
+                _parse_key(field[len(prefix):]): value
+                for field, value in state.items() if field.startswith(prefix)
+            }
+            conversations = handler._conversations
+            # الحذف عبر data حتى لا يعدّه TrackingDict تغييرًا يُعاد كتابته
+            for name, key in list(known):
+                if name == handler.name and key not in stored:
+                    conversations.data.pop(key, None)
+                    known.discard((name, key))
+            conversations.update_no_track(stored)
+            known.update((handler.name, key) for key in stored)
+
+    def _is_current(self, user_id: int, writer) -> bool:
+        """النسخة المحلية أحدث أو مساوية لما في المخزن"""
+        if user_id not in self._seen:
+            return False
+        if writer is not None and writer.startswith(f"{self._replica_id}:"):
+            # آخر من كتب هو نحن: المحلي يشمل ذلك وما بعده
+            return True
+        return writer == self._seen[user_id]
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if PERSISTENCE_SINGLE_REPLICA and user_id in self._seen:
+            persistence_stats["local_hits"] += 1
+            return
+        try:
+            state = await run_db(get_storage().get_bot_state, user_id) or {}
+        except Exception as e:
+            persistence_stats["load_errors"] += 1
+            logger.warning(f"Failed to load state for user {user_id}, keeping local copy: {e}")
+            return
+        writer = state.pop(WRITER_FIELD, None)
+        if self._is_current(user_id, writer):
+            persistence_stats["local_hits"] += 1
+            return
+        persistence_stats["loads"] += 1
+        state = self._overlay(user_id, state)
+        user_data.clear()
+        user_data.update(state.get(USER_DATA_FIELD) or {})
+        self._apply_conversations(user_id, state)
+        self._seen[user_id] = writer
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    # ============= الكتابات المجمّعة =============
+    def _stage(self, user_id: int, field: str, value):
+        self._pending.setdefault(user_id, {})[field] = value
+        self._schedule_flush(PERSISTENCE_FLUSH_DELAY)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        # PTB يمرر نسخة عميقة بالفعل
+        self._stage(user_id, USER_DATA_FIELD, data or None)
+
+    async def drop_user_data(self, user_id: int):
+        self._stage(user_id, USER_DATA_FIELD, None)
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        user_id = key[-1]
+        known = self._conversation_keys.setdefault(user_id, set())
+        if new_state is None:
+            known.discard((name, key))
+        else:
+            known.add((name, key))
+        self._stage(user_id, _conversation_field(name, key), new_state)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+
+    async def _delayed_flush(self, delay: float = PERSISTENCE_FLUSH_DELAY):
+        await asyncio.sleep(delay)
+        # بعد هذه النقطة تُنشأ مهمة جديدة لأي تغيير لاحق، والقفل يرتب الكتابات
+        self._flush_task = None
+        if not await self._write_pending() and self._pending:
+            # فشلت الكتابة: محاولة أخرى دون انتظار تغيير جديد يوقظ الكتابة
+            self._schedule_flush(PERSISTENCE_RETRY_DELAY)
+
+    async def _write_pending(self) -> int:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            self._write_seq += 1
+            writer = f"{self._replica_id}:{self._write_seq}"
+            try:
+                await run_db(get_storage().update_bot_states, {
+                    user_id: dict(fields, **{WRITER_FIELD: writer}) for user_id, fields in batch.items()
+                })
+                persistence_stats["flushes"] += 1
+                for user_id in batch:
+                    self._seen[user_id] = writer
+            except Exception as e:
+                persistence_stats["flush_errors"] += 1
+                logger.error(f"Failed to persist state for {len(batch)} users: {e}")
+                # القيم الأحدث المتراكمة أثناء الكتابة تبقى لها الأولوية
+                for user_id, fields in batch.items():
+                    merged = dict(fields)
+                    merged.update(self._pending.get(user_id, {}))
+                    self._pending[user_id] = merged
+                return 0
+            finally:
+                self._flushing = {}
+            return len(batch)
+
+    async def flush(self):
+        # تُلغى المهمة المؤجلة وهي نائمة فقط؛ الكتابة الجارية يكملها القفل قبلنا
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        written = await self._write_pending()
+        logger.info(f"Persisted state for {written} users on shutdown")
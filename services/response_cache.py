@@ -0,0 +1,103 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from cachetools import TTLCache
+from storage import get_storage
+from utils import run_db
+
+logger = logging.getLogger(__name__)
+
+# ذاكرة مؤقتة للمنشورات المولدة حسب (الفكرة بعد التطبيع، المنصة، اللهجة)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+# طبقة دائمة اختيارية في المخزن (response_cache/{key}) تشاركها جميع النسخ
+RESPONSE_CACHE_PERSISTENT = os.getenv("RESPONSE_CACHE_PERSISTENT", "0") == "1"
+# منصات لا تُخزَّن ردودها، مثال: "إنستغرام,لينكدإن"
+RESPONSE_CACHE_DISABLED_PLATFORMS = {
+    p.strip() for p in os.getenv("RESPONSE_CACHE_DISABLED_PLATFORMS", "").split(",") if p.strip()
+}
+
+_memory = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+_memory_lock = threading.Lock()
+cache_stats = {"hits": 0, "persistent_hits": 0, "misses": 0}
+
+_DIACRITICS_RE = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_SPACES_RE = re.compile(r'\s+')
+_LETTER_FORMS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي"})
+
+def normalize_input(text):
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    text = _DIACRITICS_RE.sub('', text).translate(_LETTER_FORMS)
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _SPACES_RE.sub(' ', text).strip()
+
+def make_cache_key(user_input, platform, dialect=None):
+    raw = "\x1f".join([platform, dialect or "", normalize_input(user_input)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def is_cacheable(platform):
+    return RESPONSE_CACHE_ENABLED and platform not in RESPONSE_CACHE_DISABLED_PLATFORMS
+
+def _persistent_get(key):
+    entry = get_storage().get_cached_response(key)
+    if entry and entry.get("expires_at", 0) > time.time():
+        return entry.get("content")
+    return None
+
+def _persistent_set(key, content):
+    get_storage().set_cached_response(key, content, time.time() + RESPONSE_CACHE_TTL)
+
+async def get_cached_response(user_input, platform, dialect=None):
+    if not is_cacheable(platform):
+        return None
+
+    key = make_cache_key(user_input, platform, dialect)
+    with _memory_lock:
+        content = _memory.get(key)
+    if content is not None:
+        cache_stats["hits"] += 1
+        return content
+
+    if RESPONSE_CACHE_PERSISTENT:
+        try:
+            content = await run_db(_persistent_get, key)
+        except Exception as e:
+            logger.error(f"Response cache lookup failed: {e}")
+            content = None
+        if content is not None:
+            with _memory_lock:
+                _memory[key] = content
+            cache_stats["persistent_hits"] += 1
+            return content
+
+    cache_stats["misses"] += 1
+    return None
+
+async def store_response(user_input, platform, dialect, content):
+    if not content or not is_cacheable(platform):
+        return
+
+    key = make_cache_key(user_input, platform, dialect)
+    with _memory_lock:
+        _memory[key] = content
+
+    if RESPONSE_CACHE_PERSISTENT:
+        try:
+            await run_db(_persistent_set, key, content)
+        except Exception as e:
+            logger.error(f"Response cache store failed: {e}")
+
+def get_cache_stats() -> dict:
+    hits = cache_stats["hits"] + cache_stats["persistent_hits"]
+    total = hits + cache_stats["misses"]
+    return {
+        **cache_stats,
+        "size": len(_memory),
+        "hit_rate": hits / total if total else 0.0
+    }
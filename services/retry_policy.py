@@ -0,0 +1,103 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from openai import APIConnectionError, APIStatusError
+
+logger = logging.getLogger(__name__)
+
+# ============= سياسة إعادة المحاولة =============
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+# مهلة كلية لطلب التوليد الواحد تتقاسمها جميع المحاولات
+GENERATION_DEADLINE = float(os.getenv("GENERATION_DEADLINE", "45"))
+# ميزانية إعادة المحاولة على مستوى العملية: إعادات <= النسبة × الطلبات خلال النافذة
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_WINDOW = float(os.getenv("RETRY_BUDGET_WINDOW", "60"))
+# حد أدنى من الإعادات مسموح دائمًا حتى لا تُمنع الإعادة عند قلة الحركة
+RETRY_BUDGET_MIN = int(os.getenv("RETRY_BUDGET_MIN", "5"))
+
+RETRY, FATAL = "retry", "fatal"
+_RETRYABLE_STATUS = {408, 409, 429}
+
+def _retry_after(error) -> float:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def classify_error(error) -> tuple:
+    """يعيد (RETRY أو FATAL، التأخير المطلوب من الخادم أو None)"""
+    if isinstance(error, APIStatusError):
+        status = error.status_code
+        if status in _RETRYABLE_STATUS or status >= 500:
+            return RETRY, _retry_after(error)
+        # 400/401/402/403/404/422: إعادة الطلب نفسه لن تغيّر النتيجة
+        return FATAL, None
+    if isinstance(error, (APIConnectionError, asyncio.TimeoutError)):
+        return RETRY, None
+    if isinstance(error, ValueError):
+        # فشل التحقق من النص (أقصر من 50 حرفًا أو فارغ)
+        return FATAL, None
+    return RETRY, None
+
+def backoff_delay(attempt: int) -> float:
+    """تراجع أسّي مع تشويش كامل (full jitter)"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+class RetryBudget:
+    """نسبة الإعادات إلى الطلبات في نافذة زمنية منزلقة"""
+
+    def __init__(self, ratio: float, window: float, minimum: int):
+        self.ratio = ratio
+        self.window = window
+        self.minimum = minimum
+        self.requests = deque()
+        self.retries = deque()
+
+    def _trim(self, now: float):
+        for events in (self.requests, self.retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._trim(now)
+        self.requests.append(now)
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self.retries) >= max(self.minimum, self.ratio * len(self.requests)):
+            retry_stats["denied"] += 1
+            return False
+        self.retries.append(now)
+        retry_stats["retries"] += 1
+        return True
+
+retry_stats = {"retries": 0, "denied": 0, "fatal": 0, "deadline": 0}
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_WINDOW, RETRY_BUDGET_MIN)
+
+def next_retry_delay(error, attempt: int, deadline: float):
+    """التأخير قبل المحاولة التالية، أو None إن وجب التوقف"""
+    kind, retry_after = classify_error(error)
+    if kind == FATAL:
+        retry_stats["fatal"] += 1
+        return None
+    delay = retry_after if retry_after is not None else backoff_delay(attempt)
+    if asyncio.get_running_loop().time() + delay >= deadline:
+        retry_stats["deadline"] += 1
+        logger.warning("Generation deadline reached, not retrying")
+        return None
+    if not retry_budget.try_acquire():
+        logger.warning("Retry budget exhausted, not retrying")
+        return None
+    return delay
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# ============= جدولة طلبات التوليد =============
+# عدد التوليدات الجارية في الوقت نفسه؛ الانتظار يُوزَّع بالتناوب بين المستخدمين
+# حتى لا يحجز مستخدم واحد (أو مشرف بلا حد) كل المقاعد.
+# هذا هو حد القبول الوحيد للتوليد في البوت (openai_service لا يضيف حدًا ثانيًا)؛
+# الطلب الاحتياطي للتوليد نفسه لا يأخذ مقعدًا ونسبته محدودة بـ HEDGE_MAX_RATE.
+# MAX_CONCURRENT_GENERATIONS القديم يبقى قيمة احتياطية للإعدادات الموجودة
+GENERATION_SLOTS = int(os.getenv("GENERATION_SLOTS", os.getenv("MAX_CONCURRENT_GENERATIONS", "20")))
+# رفض فوري عند تجاوز طول الطابور بدل انتظار طويل غير متوقع
+GENERATION_QUEUE_LIMIT = int(os.getenv("GENERATION_QUEUE_LIMIT", "200"))
+# لا حد لكل مستخدم: update_ordering يعالج تحديثات المستخدم الواحد بالتتابع، فلا ينتظر له
+# أكثر من توليد واحد في الوقت نفسه
+# كل كم ثانية يُعاد حساب ترتيب المنتظر وإبلاغه إن تغيّر
+QUEUE_POSITION_INTERVAL = float(os.getenv("QUEUE_POSITION_INTERVAL", "3"))
+
+class GenerationRejected(Exception):
+    """الطابور ممتلئ فرُفض الطلب دون انتظار"""
+
+_active = 0
+# user_id -> طابور انتظار ذلك المستخدم، و_rotation ترتيب الدور بين المستخدمين
+_waiting = {}
+_rotation = deque()
+scheduler_stats = {"admitted": 0, "queued": 0, "shed": 0}
+
+def get_queue_length() -> int:
+    return sum(len(waiters) for waiters in _waiting.values())
+
+def get_active_generations() -> int:
+    return _active
+
+def queue_position(user_id: int, waiter) -> int:
+    """ترتيب المنتظر (1 = التالي) وفق التناوب الحالي بين المستخدمين"""
+    waiters = _waiting.get(user_id)
+    if not waiters or waiter not in waiters:
+        return 0
+    index = waiters.index(waiter)
+    ahead = index
+    before = True
+    for other in _rotation:
+        if other == user_id:
+            before = False
+            continue
+        # من يسبقه في الدور يحصل على index + 1 مقعدًا قبله، ومن يليه على index
+        ahead += min(len(_waiting[other]), index + 1 if before else index)
+    return ahead + 1
+
+def _dispatch():
+    global _active
+    while _active < GENERATION_SLOTS and _rotation:
+        user_id = _rotation.popleft()
+        waiters = _waiting[user_id]
+        waiter = waiters.popleft()
+        if waiters:
+            _rotation.append(user_id)
+        else:
+            del _waiting[user_id]
+        if not waiter.done():
+            waiter.set_result(None)
+            _active += 1
+
+def _remove(user_id: int, waiter):
+    waiters = _waiting.get(user_id)
+    if waiters and waiter in waiters:
+        waiters.remove(waiter)
+        if not waiters:
+            del _waiting[user_id]
+            _rotation.remove(user_id)
+
+async def _wait_for_turn(user_id: int, on_position):
+    waiters = _waiting.get(user_id)
+    if get_queue_length() >= GENERATION_QUEUE_LIMIT:
+        scheduler_stats["shed"] += 1
+        raise GenerationRejected()
+
+    waiter = asyncio.get_running_loop().create_future()
+    if waiters is None:
+        waiters = _waiting[user_id] = deque()
+        _rotation.append(user_id)
+    waiters.append(waiter)
+    scheduler_stats["queued"] += 1
+
+    reported = None
+    try:
+        while True:
+            position = queue_position(user_id, waiter)
+            if on_position and position and position != reported:
+                reported = position
+                await on_position(position)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), QUEUE_POSITION_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                continue
+    except BaseException:
+        _remove(user_id, waiter)
+        if waiter.done() and not waiter.cancelled():
+            # حصل على المقعد لحظة الإلغاء: نعيده لمن يليه
+            _release()
+        raise
+
+def _release():
+    global _active
+    _active -= 1
+    _dispatch()
+
+@asynccontextmanager
+async def generation_slot(user_id: int, on_position=None):
+    """يحجز مقعد توليد؛ on_position(ترتيب) تُستدعى عند الانتظار وكلما تغيّر الترتيب"""
+    global _active
+    if _active < GENERATION_SLOTS and not _rotation:
+        _active += 1
+    else:
+        await _wait_for_turn(user_id, on_position)
+    scheduler_stats["admitted"] += 1
+    try:
+        yield
+    finally:
+        _release()
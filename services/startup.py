@@ -0,0 +1,41 @@
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ============= زمن الإقلاع =============
+# بعد ربط الـ webhook: تهيئة المخزن وفتح اتصال OpenRouter في الخلفية بدل انتظار أول طلب
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+
+# يُستورد أول وحدات main.py فيشمل القياس استيراد بقية الوحدات
+_started = time.perf_counter()
+_phases = {}
+
+def mark(phase: str):
+    """يسجل زمن بلوغ المرحلة منذ بدء الاستيراد (المرة الأولى فقط)"""
+    _phases.setdefault(phase, time.perf_counter() - _started)
+
+def get_startup_phases() -> dict:
+    return dict(_phases)
+
+def startup_report() -> str:
+    return ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in _phases.items())
+
+async def _warm_storage():
+    from utils import run_db, get_quota_epoch
+    # أول قراءة تنشئ المخزن (تهيئة Firebase) وتملأ ذاكرة حقبة الحصة التي يحتاجها أول توليد
+    await run_db(get_quota_epoch)
+    mark("storage_ready")
+
+async def _warm_openrouter():
+    from services.openai_service import prewarm_connection
+    if await prewarm_connection():
+        mark("openrouter_ready")
+
+async def prewarm():
+    results = await asyncio.gather(_warm_storage(), _warm_openrouter(), return_exceptions=True)
+    for name, result in zip(("storage", "openrouter"), results):
+        if isinstance(result, Exception):
+            logger.warning(f"Pre-warming {name} failed: {result}")
@@ -0,0 +1,71 @@
+import os
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# ============= معالجة التحديثات بالتوازي =============
+# عدد التحديثات المعالجة في الوقت نفسه (1 = تحديث واحد في كل مرة كما في PTB افتراضيًا)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "256"))
+# حد PTB الخارجي: التحديثات المحتجزة معًا بين منتظرة دور مستخدمها وجارية
+UPDATE_BACKLOG = int(os.getenv("UPDATE_BACKLOG", "4096"))
+
+ordering_stats = {"processed": 0, "waited": 0}
+
+def ordering_key(update: object):
+    """تحديثات المستخدم الواحد (أو الدردشة إن لم يكن للتحديث مستخدم) تُعالج بترتيب وصولها"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return ("user", update.effective_user.id)
+    if update.effective_chat:
+        return ("chat", update.effective_chat.id)
+    return None
+
+def configure_concurrency(builder):
+    """يفعّل المعالجة المتوازية المرتبة لكل مستخدم على ApplicationBuilder إن كان UPDATE_CONCURRENCY > 1"""
+    if UPDATE_CONCURRENCY <= 1:
+        return builder
+    return builder.application_class(OrderedApplication).concurrent_updates(max(UPDATE_BACKLOG, UPDATE_CONCURRENCY))
+
+class OrderedApplication(Application):
+    """Application يعالج تحديثات المستخدمين المختلفين بالتوازي وتحديثات المستخدم الواحد بالتتابع
+
+    يُستخدم مع concurrent_updates في ApplicationBuilder: PTB ينشئ مهمة لكل تحديث،
+    وهنا تنتظر المهمة دور مستخدمها أولًا ثم مقعدًا من UPDATE_CONCURRENCY، فلا تحجز
+    تحديثات مستخدم يرسل بكثرة مقاعد الآخرين وهي تنتظر.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # key -> [قفل, عدد المهام التي تحمله أو تنتظره]
+        self._ordering_locks = {}
+        self._update_slots = asyncio.BoundedSemaphore(max(1, UPDATE_CONCURRENCY))
+
+    def get_waiting_updates(self) -> int:
+        return sum(users - 1 for _, users in self._ordering_locks.values())
+
+    async def process_update(self, update: object):
+        key = ordering_key(update)
+        if key is None:
+            async with self._update_slots:
+                return await super().process_update(update)
+
+        entry = self._ordering_locks.get(key)
+        if entry is None:
+            entry = self._ordering_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[0].locked():
+            ordering_stats["waited"] += 1
+        try:
+            # asyncio.Lock يوقظ المنتظرين بترتيب وصولهم فيبقى ترتيب التحديثات محفوظًا
+            async with entry[0]:
+                async with self._update_slots:
+                    ordering_stats["processed"] += 1
+                    return await super().process_update(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._ordering_locks[key]
@@ -0,0 +1,41 @@
+import os
+import logging
+import threading
+from storage.base import Storage
+
+logger = logging.getLogger(__name__)
+
+# firebase (افتراضي) | sqlite | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firebase").strip().lower()
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    # الاستيراد داخل الدالة حتى لا تُطلب firebase_admin مع المخازن المحلية
+    if backend == "firebase":
+        from storage.firebase import FirebaseStorage
+        return FirebaseStorage()
+    if backend == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage()
+    if backend == "memory":
+        from storage.memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+def get_storage() -> Storage:
+    """المخزن الحالي؛ يُنشأ عند أول استخدام لا عند الاستيراد"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+                logger.info(f"Using {_storage.name} storage backend")
+    return _storage
+
+def set_storage(storage: Storage):
+    """استبدال المخزن (للاختبارات الحِمْلية والأدوات)"""
+    global _storage
+    with _storage_lock:
+        _storage = storage
@@ -0,0 +1,105 @@
+class Storage:
+    """الواجهة المشتركة لكل مخازن البيانات (Firebase / SQLite / الذاكرة)
+
+    التخطيط المنطقي مطابق لشجرة Firebase:
+      users/{user_id}                 سجل المستخدم
+      post_logs/{day}/{push_id}       سجلات المنشورات مقسمة حسب اليوم
+      post_log_days/{day}             عدد منشورات اليوم
+      stats/{group}/{name}            عدادات الإحصائيات
+      quota/epoch                     حقبة الحصة اليومية
+      broadcasts/{broadcast_id}       حالة الإشعارات العامة
+      response_cache/{key}            الطبقة الدائمة لذاكرة الردود
+      bot_state/{user_id}/{field}     user_data وحالات المحادثات (StoragePersistence)
+    """
+
+    name = "base"
+
+    # ============= المستخدمون =============
+    def get_all_users(self) -> dict:
+        raise NotImplementedError
+
+    def get_user(self, user_id: int):
+        raise NotImplementedError
+
+    def transact_user(self, user_id: int, func) -> dict:
+        """يطبق func(السجل الحالي أو None) ذريًا ويعيد السجل الجديد؛ أي استثناء من func يلغي المعاملة"""
+        raise NotImplementedError
+
+    def apply_updates(self, user_fields: dict, stat_increments: dict):
+        """{user_id: {field: value}} و{"group/name": مقدار} في كتابة واحدة؛ القيمة None تحذف الحقل"""
+        raise NotImplementedError
+
+    def get_recipient_ids(self, after_user_id: int = None) -> list:
+        """معرّفات المستخدمين غير المحظورين مرتبة تصاعديًا"""
+        raise NotImplementedError
+
+    def mark_users_blocked(self, user_ids: list):
+        raise NotImplementedError
+
+    # ============= الحصة =============
+    def get_quota_epoch(self) -> int:
+        raise NotImplementedError
+
+    def bump_quota_epoch(self) -> int:
+        raise NotImplementedError
+
+    # ============= السجلات =============
+    def append_logs(self, entries: list, stat_increments: dict):
+        """entries: قائمة (day, push_id, record) تُكتب مع فهرس الأيام والعدادات دفعةً واحدة"""
+        raise NotImplementedError
+
+    def get_logs(self, start_day: str = None) -> dict:
+        raise NotImplementedError
+
+    def has_log(self, day: str, push_id: str) -> bool:
+        raise NotImplementedError
+
+    def get_post_counts(self, start_day: str) -> dict:
+        raise NotImplementedError
+
+    def prune_logs(self, cutoff_day: str, chunk: int) -> int:
+        """يحذف حتى chunk سجلًا من أقدم يوم قبل cutoff_day ويعيد عددها"""
+        raise NotImplementedError
+
+    def clear_logs(self):
+        raise NotImplementedError
+
+    # ============= الإحصائيات =============
+    def get_stat_group(self, group: str) -> dict:
+        raise NotImplementedError
+
+    def get_stat(self, path: str) -> int:
+        raise NotImplementedError
+
+    def replace_stats(self, stats: dict):
+        raise NotImplementedError
+
+    # ============= الإشعارات العامة =============
+    def save_broadcast(self, broadcast_id: str, state: dict):
+        raise NotImplementedError
+
+    def get_broadcasts(self) -> dict:
+        raise NotImplementedError
+
+    def transact_broadcast(self, broadcast_id: str, func) -> dict:
+        """مثل transact_user لحالة إشعار واحد (لحجز ملكيته بين العمليات)"""
+        raise NotImplementedError
+
+    # ============= ذاكرة الردود =============
+    def get_cached_response(self, key: str):
+        raise NotImplementedError
+
+    def set_cached_response(self, key: str, content: str, expires_at: float):
+        raise NotImplementedError
+
+    # ============= حالة البوت =============
+    def get_bot_state(self, user_id: int):
+        """حقول حالة المستخدم {field: value} أو None"""
+        raise NotImplementedError
+
+    def update_bot_states(self, updates: dict):
+        """{user_id: {field: value}} في كتابة واحدة؛ كل حقل يُستبدل كاملًا والقيمة None تحذفه"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
@@ -0,0 +1,161 @@
+import os
+import json
+import logging
+import firebase_admin
+from firebase_admin import credentials, db
+from storage.base import Storage
+
+logger = logging.getLogger(__name__)
+
+# ============= تهيئة Firebase =============
+def initialize_firebase():
+    if not firebase_admin._apps:
+        try:
+            cred = credentials.Certificate(json.loads(os.getenv("FIREBASE_CREDENTIALS_JSON")))
+            firebase_admin.initialize_app(cred, {
+                'databaseURL': os.getenv("FIREBASE_DB_URL")
+            })
+        except Exception as e:
+            logger.error(f"Firebase initialization failed: {e}")
+            raise
+
+def _increment(amount: int = 1) -> dict:
+    return {".sv": {"increment": amount}}
+
+class FirebaseStorage(Storage):
+    name = "firebase"
+
+    def __init__(self):
+        initialize_firebase()
+
+    # ============= المستخدمون =============
+    def get_all_users(self) -> dict:
+        return db.reference("/users").get() or {}
+
+    def get_user(self, user_id: int):
+        return db.reference(f"/users/{user_id}").get()
+
+    def transact_user(self, user_id: int, func) -> dict:
+        return db.reference(f"/users/{user_id}").transaction(func)
+
+    def apply_updates(self, user_fields: dict, stat_increments: dict):
+        updates = {
+            f"users/{uid}/{field}": value
+            for uid, fields in user_fields.items()
+            for field, value in fields.items()
+        }
+        updates.update({f"stats/{path}": _increment(amount) for path, amount in stat_increments.items()})
+        if updates:
+            db.reference("/").update(updates)
+
+    def get_recipient_ids(self, after_user_id: int = None) -> list:
+        users = self.get_all_users()
+        recipients = sorted(
+            int(uid) for uid, data in users.items()
+            if str(uid).lstrip("-").isdigit() and not (isinstance(data, dict) and data.get("blocked"))
+        )
+        if after_user_id is not None:
+            recipients = [uid for uid in recipients if uid > after_user_id]
+        return recipients
+
+    def mark_users_blocked(self, user_ids: list):
+        db.reference("/users").update({f"{uid}/blocked": True for uid in user_ids})
+
+    # ============= الحصة =============
+    def get_quota_epoch(self) -> int:
+        return db.reference("/quota/epoch").get() or 0
+
+    def bump_quota_epoch(self) -> int:
+        return db.reference("/quota/epoch").transaction(lambda current: (current or 0) + 1)
+
+    # ============= السجلات =============
+    def append_logs(self, entries: list, stat_increments: dict):
+        updates = {}
+        days = {}
+        for day, push_id, record in entries:
+            updates[f"post_logs/{day}/{push_id}"] = record
+            days[day] = days.get(day, 0) + 1
+        for day, amount in days.items():
+            updates[f"post_log_days/{day}"] = _increment(amount)
+        updates.update({f"stats/{path}": _increment(amount) for path, amount in stat_increments.items()})
+        db.reference("/").update(updates)
+
+    def get_logs(self, start_day: str = None) -> dict:
+        ref = db.reference("/post_logs")
+        if start_day is None:
+            return ref.get() or {}
+        return ref.order_by_key().start_at(start_day).get() or {}
+
+    def has_log(self, day: str, push_id: str) -> bool:
+        return db.reference(f"/post_logs/{day}/{push_id}").get(shallow=True) is not None
+
+    def get_post_counts(self, start_day: str) -> dict:
+        return dict(db.reference("/post_log_days").order_by_key().start_at(start_day).get() or {})
+
+    def prune_logs(self, cutoff_day: str, chunk: int) -> int:
+        expired = db.reference("/post_log_days").order_by_key().end_at(cutoff_day).limit_to_first(1).get() or {}
+        for day in expired:
+            if day >= cutoff_day:
+                continue
+            keys = list((db.reference(f"/post_logs/{day}").get(shallow=True) or {}).keys())
+            batch = keys[:chunk]
+            updates = {f"post_logs/{day}/{key}": None for key in batch}
+            if len(keys) <= chunk:
+                # آخر دفعة لهذا اليوم: نحذف مدخل الفهرس أيضًا
+                updates[f"post_log_days/{day}"] = None
+            db.reference("/").update(updates)
+            logger.info(f"Pruned {len(batch)} logs from {day}")
+            return len(batch)
+        return 0
+
+    def clear_logs(self):
+        db.reference("/").update({
+            "logs": None,
+            "post_logs": None,
+            "post_log_days": None,
+            "stats/totals/posts": 0,
+            "stats/platforms": None
+        })
+
+    # ============= الإحصائيات =============
+    def get_stat_group(self, group: str) -> dict:
+        return db.reference(f"/stats/{group}").get() or {}
+
+    def get_stat(self, path: str) -> int:
+        return db.reference(f"/stats/{path}").get() or 0
+
+    def replace_stats(self, stats: dict):
+        db.reference("/stats").set(stats)
+
+    # ============= الإشعارات العامة =============
+    def save_broadcast(self, broadcast_id: str, state: dict):
+        db.reference(f"/broadcasts/{broadcast_id}").update(state)
+
+    def get_broadcasts(self) -> dict:
+        return db.reference("/broadcasts").get() or {}
+
+    def transact_broadcast(self, broadcast_id: str, func) -> dict:
+        return db.reference(f"/broadcasts/{broadcast_id}").transaction(func)
+
+    # ============= ذاكرة الردود =============
+    def get_cached_response(self, key: str):
+        return db.reference(f"/response_cache/{key}").get()
+
+    def set_cached_response(self, key: str, content: str, expires_at: float):
+        db.reference(f"/response_cache/{key}").set({
+            "content": content,
+            "expires_at": expires_at
+        })
+
+    # ============= حالة البوت =============
+    def get_bot_state(self, user_id: int):
+        return db.reference(f"/bot_state/{user_id}").get()
+
+    def update_bot_states(self, updates: dict):
+        payload = {
+            f"{user_id}/{field}": value
+            for user_id, fields in updates.items()
+            for field, value in fields.items()
+        }
+        if payload:
+            db.reference("/bot_state").update(payload)
@@ -0,0 +1,175 @@
+import copy
+import threading
+from storage.base import Storage
+
+class MemoryStorage(Storage):
+    """مخزن في الذاكرة للتطوير والاختبارات الحِمْلية دون اتصال؛ يُفقد عند إعادة التشغيل"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}
+        self._logs = {}
+        self._log_days = {}
+        self._stats = {}
+        self._epoch = 0
+        self._broadcasts = {}
+        self._response_cache = {}
+        self._bot_state = {}
+
+    def _add_stats(self, stat_increments: dict):
+        for path, amount in stat_increments.items():
+            group, _, name = path.partition("/")
+            counters = self._stats.setdefault(group, {})
+            counters[name] = counters.get(name, 0) + amount
+
+    # ============= المستخدمون =============
+    def get_all_users(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._users)
+
+    def get_user(self, user_id: int):
+        with self._lock:
+            return copy.deepcopy(self._users.get(str(user_id)))
+
+    def transact_user(self, user_id: int, func) -> dict:
+        with self._lock:
+            updated = func(copy.deepcopy(self._users.get(str(user_id))))
+            self._users[str(user_id)] = copy.deepcopy(updated)
+            return updated
+
+    def apply_updates(self, user_fields: dict, stat_increments: dict):
+        with self._lock:
+            for uid, fields in user_fields.items():
+                record = self._users.setdefault(str(uid), {})
+                for field, value in fields.items():
+                    if value is None:
+                        record.pop(field, None)
+                    else:
+                        record[field] = copy.deepcopy(value)
+            self._add_stats(stat_increments)
+
+    def get_recipient_ids(self, after_user_id: int = None) -> list:
+        with self._lock:
+            recipients = sorted(
+                int(uid) for uid, data in self._users.items()
+                if uid.lstrip("-").isdigit() and not data.get("blocked")
+            )
+        if after_user_id is not None:
+            recipients = [uid for uid in recipients if uid > after_user_id]
+        return recipients
+
+    def mark_users_blocked(self, user_ids: list):
+        with self._lock:
+            for uid in user_ids:
+                self._users.setdefault(str(uid), {})["blocked"] = True
+
+    # ============= الحصة =============
+    def get_quota_epoch(self) -> int:
+        return self._epoch
+
+    def bump_quota_epoch(self) -> int:
+        with self._lock:
+            self._epoch += 1
+            return self._epoch
+
+    # ============= السجلات =============
+    def append_logs(self, entries: list, stat_increments: dict):
+        with self._lock:
+            for day, push_id, record in entries:
+                self._logs.setdefault(day, {})[push_id] = dict(record)
+                self._log_days[day] = self._log_days.get(day, 0) + 1
+            self._add_stats(stat_increments)
+
+    def get_logs(self, start_day: str = None) -> dict:
+        with self._lock:
+            return {
+                day: copy.deepcopy(posts) for day, posts in sorted(self._logs.items())
+                if start_day is None or day >= start_day
+            }
+
+    def has_log(self, day: str, push_id: str) -> bool:
+        with self._lock:
+            return push_id in self._logs.get(day, {})
+
+    def get_post_counts(self, start_day: str) -> dict:
+        with self._lock:
+            return {day: count for day, count in sorted(self._log_days.items()) if day >= start_day}
+
+    def prune_logs(self, cutoff_day: str, chunk: int) -> int:
+        with self._lock:
+            expired = sorted(day for day in self._logs if day < cutoff_day)
+            if not expired:
+                return 0
+            day = expired[0]
+            posts = self._logs[day]
+            batch = sorted(posts)[:chunk]
+            for key in batch:
+                del posts[key]
+            if not posts:
+                del self._logs[day]
+                self._log_days.pop(day, None)
+            return len(batch)
+
+    def clear_logs(self):
+        with self._lock:
+            self._logs.clear()
+            self._log_days.clear()
+            self._stats.setdefault("totals", {})["posts"] = 0
+            self._stats.pop("platforms", None)
+
+    # ============= الإحصائيات =============
+    def get_stat_group(self, group: str) -> dict:
+        with self._lock:
+            return dict(self._stats.get(group, {}))
+
+    def get_stat(self, path: str) -> int:
+        group, _, name = path.partition("/")
+        with self._lock:
+            return self._stats.get(group, {}).get(name, 0)
+
+    def replace_stats(self, stats: dict):
+        with self._lock:
+            self._stats = copy.deepcopy(stats)
+
+    # ============= الإشعارات العامة =============
+    def save_broadcast(self, broadcast_id: str, state: dict):
+        with self._lock:
+            self._broadcasts.setdefault(broadcast_id, {}).update(copy.deepcopy(state))
+
+    def get_broadcasts(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._broadcasts)
+
+    def transact_broadcast(self, broadcast_id: str, func) -> dict:
+        with self._lock:
+            updated = func(copy.deepcopy(self._broadcasts.get(broadcast_id)))
+            self._broadcasts[broadcast_id] = copy.deepcopy(updated)
+            return updated
+
+    # ============= ذاكرة الردود =============
+    def get_cached_response(self, key: str):
+        with self._lock:
+            return copy.deepcopy(self._response_cache.get(key))
+
+    def set_cached_response(self, key: str, content: str, expires_at: float):
+        with self._lock:
+            self._response_cache[key] = {"content": content, "expires_at": expires_at}
+
+    # ============= حالة البوت =============
+    def get_bot_state(self, user_id: int):
+        with self._lock:
+            return copy.deepcopy(self._bot_state.get(str(user_id)))
+
+    def update_bot_states(self, updates: dict):
+        with self._lock:
+            for user_id, fields in updates.items():
+                state = self._bot_state.setdefault(str(user_id), {})
+                for field, value in fields.items():
+                    if value is None:
+                        state.pop(field, None)
+                    else:
+                        state[field] = copy.deepcopy(value)
+                if not state:
+                    del self._bot_state[str(user_id)]
@@ -0,0 +1,357 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from storage.base import Storage
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot.db")
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+# حجم ذاكرة العبارات المُحضّرة لكل اتصال (الاستعلامات كلها بمعاملات ثابتة النص)
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL DEFAULT '{}',
+    blocked INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_recipients ON users (blocked, user_id);
+
+CREATE TABLE IF NOT EXISTS post_logs (
+    day TEXT NOT NULL,
+    push_id TEXT NOT NULL,
+    user_id INTEGER,
+    platform TEXT,
+    content TEXT,
+    timestamp TEXT,
+    PRIMARY KEY (day, push_id)
+);
+
+CREATE TABLE IF NOT EXISTS post_log_days (
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stats (
+    grp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (grp, name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    broadcast_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bot_state (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+_INCREMENT_STAT = (
+    "INSERT INTO stats (grp, name, value) VALUES (?, ?, ?) "
+    "ON CONFLICT (grp, name) DO UPDATE SET value = value + excluded.value"
+)
+_LOG_COLUMNS = ("user_id", "platform", "content", "timestamp")
+
+def _split_stats(stat_increments: dict) -> list:
+    rows = []
+    for path, amount in stat_increments.items():
+        group, _, name = path.partition("/")
+        rows.append((group, name, amount))
+    return rows
+
+class SQLiteStorage(Storage):
+    """مخزن محلي بملف SQLite: وضع WAL، اتصال لكل خيط، وكل كتابة دفعة في معاملة واحدة"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        logger.info(f"SQLite storage ready at {path}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: نتحكم بالمعاملات يدويًا عبر _write
+            conn = sqlite3.connect(
+                self.path,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=SQLITE_STATEMENT_CACHE
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE يحجز قفل الكتابة من البداية فلا تفشل المعاملة عند الترقية
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ============= المستخدمون =============
+    def get_all_users(self) -> dict:
+        rows = self._conn().execute("SELECT user_id, data FROM users")
+        return {str(user_id): json.loads(data) for user_id, data in rows}
+
+    def get_user(self, user_id: int):
+        row = self._conn().execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def transact_user(self, user_id: int, func) -> dict:
+        with self._write() as conn:
+            row = conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            updated = func(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data",
+                (user_id, json.dumps(updated, ensure_ascii=False))
+            )
+        return updated
+
+    def apply_updates(self, user_fields: dict, stat_increments: dict):
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                [(int(uid),) for uid in user_fields]
+            )
+            # json_patch يدمج الحقول ويحذف ما قيمته null كما في تحديث Firebase؛
+            # عمود blocked يتبع $.blocked بعد الدمج (إزالة الحظر تحذف الحقل)
+            conn.executemany(
+                "UPDATE users SET data = json_patch(data, ?1), "
+                "blocked = coalesce(json_extract(json_patch(data, ?1), '$.blocked'), 0) != 0 WHERE user_id = ?2",
+                [(json.dumps(fields, ensure_ascii=False), int(uid)) for uid, fields in user_fields.items()]
+            )
+            conn.executemany(_INCREMENT_STAT, _split_stats(stat_increments))
+
+    def get_recipient_ids(self, after_user_id: int = None) -> list:
+        rows = self._conn().execute(
+            "SELECT user_id FROM users WHERE blocked = 0 AND user_id > ? ORDER BY user_id",
+            (after_user_id if after_user_id is not None else -(2 ** 63),)
+        )
+        return [user_id for (user_id,) in rows]
+
+    def mark_users_blocked(self, user_ids: list):
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                [(int(uid),) for uid in user_ids]
+            )
+            conn.executemany(
+                "UPDATE users SET blocked = 1, data = json_set(data, '$.blocked', json('true')) WHERE user_id = ?",
+                [(int(uid),) for uid in user_ids]
+            )
+
+    # ============= الحصة =============
+    def get_quota_epoch(self) -> int:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'quota_epoch'").fetchone()
+        return row[0] if row else 0
+
+    def bump_quota_epoch(self) -> int:
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('quota_epoch', 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+            )
+            return conn.execute("SELECT value FROM meta WHERE key = 'quota_epoch'").fetchone()[0]
+
+    # ============= السجلات =============
+    def append_logs(self, entries: list, stat_increments: dict):
+        days = {}
+        rows = []
+        for day, push_id, record in entries:
+            rows.append((day, push_id) + tuple(record.get(column) for column in _LOG_COLUMNS))
+            days[day] = days.get(day, 0) + 1
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO post_logs (day, push_id, user_id, platform, content, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(
+                "INSERT INTO post_log_days (day, count) VALUES (?, ?) "
+                "ON CONFLICT (day) DO UPDATE SET count = count + excluded.count",
+                list(days.items())
+            )
+            conn.executemany(_INCREMENT_STAT, _split_stats(stat_increments))
+
+    def get_logs(self, start_day: str = None) -> dict:
+        rows = self._conn().execute(
+            "SELECT day, push_id, user_id, platform, content, timestamp FROM post_logs "
+            "WHERE day >= ? ORDER BY day, push_id",
+            (start_day or "",)
+        )
+        logs = {}
+        for day, push_id, *values in rows:
+            logs.setdefault(day, {})[push_id] = {
+                column: value for column, value in zip(_LOG_COLUMNS, values) if value is not None
+            }
+        return logs
+
+    def has_log(self, day: str, push_id: str) -> bool:
+        return self._conn().execute(
+            "SELECT 1 FROM post_logs WHERE day = ? AND push_id = ?", (day, push_id)
+        ).fetchone() is not None
+
+    def get_post_counts(self, start_day: str) -> dict:
+        rows = self._conn().execute(
+            "SELECT day, count FROM post_log_days WHERE day >= ? ORDER BY day", (start_day,)
+        )
+        return dict(rows)
+
+    def prune_logs(self, cutoff_day: str, chunk: int) -> int:
+        with self._write() as conn:
+            day = conn.execute("SELECT MIN(day) FROM post_logs WHERE day < ?", (cutoff_day,)).fetchone()[0]
+            if day is None:
+                conn.execute("DELETE FROM post_log_days WHERE day < ?", (cutoff_day,))
+                return 0
+            deleted = conn.execute(
+                "DELETE FROM post_logs WHERE day = ? AND push_id IN "
+                "(SELECT push_id FROM post_logs WHERE day = ? ORDER BY push_id LIMIT ?)",
+                (day, day, chunk)
+            ).rowcount
+            if conn.execute("SELECT 1 FROM post_logs WHERE day = ? LIMIT 1", (day,)).fetchone() is None:
+                conn.execute("DELETE FROM post_log_days WHERE day = ?", (day,))
+        logger.info(f"Pruned {deleted} logs from {day}")
+        return deleted
+
+    def clear_logs(self):
+        with self._write() as conn:
+            conn.execute("DELETE FROM post_logs")
+            conn.execute("DELETE FROM post_log_days")
+            conn.execute("DELETE FROM stats WHERE grp = 'platforms'")
+            conn.execute(
+                "INSERT INTO stats (grp, name, value) VALUES ('totals', 'posts', 0) "
+                "ON CONFLICT (grp, name) DO UPDATE SET value = 0"
+            )
+
+    # ============= الإحصائيات =============
+    def get_stat_group(self, group: str) -> dict:
+        return dict(self._conn().execute("SELECT name, value FROM stats WHERE grp = ?", (group,)))
+
+    def get_stat(self, path: str) -> int:
+        group, _, name = path.partition("/")
+        row = self._conn().execute(
+            "SELECT value FROM stats WHERE grp = ? AND name = ?", (group, name)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def replace_stats(self, stats: dict):
+        rows = [
+            (group, name, value)
+            for group, counters in stats.items()
+            for name, value in counters.items()
+        ]
+        with self._write() as conn:
+            conn.execute("DELETE FROM stats")
+            conn.executemany("INSERT INTO stats (grp, name, value) VALUES (?, ?, ?)", rows)
+
+    # ============= الإشعارات العامة =============
+    def save_broadcast(self, broadcast_id: str, state: dict):
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT state FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,)
+            ).fetchone()
+            merged = json.loads(row[0]) if row else {}
+            merged.update(state)
+            conn.execute(
+                "INSERT OR REPLACE INTO broadcasts (broadcast_id, state) VALUES (?, ?)",
+                (broadcast_id, json.dumps(merged, ensure_ascii=False))
+            )
+
+    def get_broadcasts(self) -> dict:
+        rows = self._conn().execute("SELECT broadcast_id, state FROM broadcasts")
+        return {broadcast_id: json.loads(state) for broadcast_id, state in rows}
+
+    def transact_broadcast(self, broadcast_id: str, func) -> dict:
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT state FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,)
+            ).fetchone()
+            updated = func(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO broadcasts (broadcast_id, state) VALUES (?, ?)",
+                (broadcast_id, json.dumps(updated, ensure_ascii=False))
+            )
+        return updated
+
+    # ============= ذاكرة الردود =============
+    def get_cached_response(self, key: str):
+        row = self._conn().execute(
+            "SELECT content, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        return {"content": row[0], "expires_at": row[1]} if row else None
+
+    def set_cached_response(self, key: str, content: str, expires_at: float):
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, content, expires_at) VALUES (?, ?, ?)",
+                (key, content, expires_at)
+            )
+
+    # ============= حالة البوت =============
+    def get_bot_state(self, user_id: int):
+        row = self._conn().execute("SELECT data FROM bot_state WHERE user_id = ?", (int(user_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_bot_states(self, updates: dict):
+        # لا json_patch هنا: الحقل يُستبدل كاملًا (user_data بلا مفاتيحه المحذوفة) لا يُدمج
+        with self._write() as conn:
+            for user_id, fields in updates.items():
+                row = conn.execute("SELECT data FROM bot_state WHERE user_id = ?", (int(user_id),)).fetchone()
+                state = json.loads(row[0]) if row else {}
+                for field, value in fields.items():
+                    if value is None:
+                        state.pop(field, None)
+                    else:
+                        state[field] = value
+                if state:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO bot_state (user_id, data) VALUES (?, ?)",
+                        (int(user_id), json.dumps(state, ensure_ascii=False))
+                    )
+                else:
+                    conn.execute("DELETE FROM bot_state WHERE user_id = ?", (int(user_id),))
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+# قبل استيراد أي وحدة: الإعدادات تُقرأ من البيئة عند الاستيراد
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("LOG_FILE", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+import utils  # noqa: E402
+from storage import set_storage  # noqa: E402
+from storage.memory import MemoryStorage  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def memory_storage(monkeypatch):
+    """مخزن ذاكرة جديد وذاكرات utils فارغة لكل اختبار"""
+    storage = MemoryStorage()
+    set_storage(storage)
+    monkeypatch.setattr(utils, "_user_cache", utils.LRUCache(maxsize=utils.USER_CACHE_SIZE))
+    monkeypatch.setattr(utils, "_dirty_users", {})
+    monkeypatch.setattr(utils, "_unpersisted_users", set())
+    monkeypatch.setattr(utils, "_pending_stats", {})
+    monkeypatch.setattr(utils, "_quota_epoch_cache", utils.TTLCache(maxsize=1, ttl=utils.QUOTA_EPOCH_TTL))
+    monkeypatch.setattr(utils, "_last_quota_epoch", None)
+    return storage
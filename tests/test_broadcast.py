@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+import utils
+from services import broadcast
+from services.broadcast import BroadcastNotOwned
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(chat_id)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+STATE = {"status": "running", "text": "hi", "admin_chat_id": 1, "progress_message_id": 2}
+
+@pytest.fixture
+def users():
+    for uid in (10, 11, 12):
+        utils.save_user_data(uid, {"first_name": str(uid)})
+    utils.flush_user_updates()
+
+def test_broadcast_is_delivered_and_marked_done(users):
+    bot = FakeBot()
+    utils.save_broadcast_state("b", dict(STATE))
+    asyncio.run(broadcast._run_guarded(bot, "b", dict(STATE)))
+    assert sorted(bot.sent) == [10, 11, 12]
+    assert utils.get_storage().get_broadcasts()["b"]["status"] == "done"
+
+def test_live_lease_of_another_process_is_respected(users, monkeypatch):
+    utils.save_broadcast_state("b", dict(STATE))
+    monkeypatch.setattr(broadcast, "OWNER_ID", "other-process")
+    asyncio.run(utils.transact_broadcast_async("b", broadcast._claim()))
+    monkeypatch.undo()
+
+    bot = FakeBot()
+    asyncio.run(broadcast._run_guarded(bot, "b", dict(STATE)))
+    assert bot.sent == []
+    assert utils.get_storage().get_broadcasts()["b"]["owner"] == "other-process"
+
+def test_expired_lease_is_taken_over(users):
+    utils.save_broadcast_state("b", dict(STATE, owner="crashed", lease_until=0))
+    bot = FakeBot()
+    asyncio.run(broadcast._run_guarded(bot, "b", dict(STATE)))
+    assert sorted(bot.sent) == [10, 11, 12]
+
+def test_claim_rejects_finished_broadcast():
+    with pytest.raises(BroadcastNotOwned):
+        broadcast._claim()(dict(STATE, status="done"))
+
+def test_storage_error_marks_broadcast_failed(users, monkeypatch):
+    async def unavailable(cursor):
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr(broadcast, "get_broadcast_recipients_async", unavailable)
+    utils.save_broadcast_state("b", dict(STATE))
+    bot = FakeBot()
+    asyncio.run(broadcast._run_guarded(bot, "b", dict(STATE)))
+    assert utils.get_storage().get_broadcasts()["b"]["status"] == "failed"
+    assert bot.edits
+
+def test_interaction_clears_the_blocked_flag(users):
+    utils.mark_users_blocked([11])
+    assert utils.get_broadcast_recipients() == [10, 12]
+    utils.save_user_data(11, {"last_active": "now"})
+    utils.flush_user_updates()
+    assert utils.get_broadcast_recipients() == [10, 11, 12]
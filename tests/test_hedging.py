@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+import pytest
+from services import hedging
+from services.hedging import run_hedged
+
+@pytest.fixture(autouse=True)
+def hedging_enabled(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 0.02)
+    monkeypatch.setattr(hedging, "_latencies", {})
+    monkeypatch.setattr(hedging, "_recent_hedges", deque(maxlen=hedging.HEDGE_WINDOW))
+    monkeypatch.setattr(hedging, "hedge_stats", {"requests": 0, "hedged": 0, "hedge_wins": 0})
+
+def test_fast_primary_is_not_hedged():
+    calls = []
+
+    async def primary():
+        return "primary"
+
+    async def hedge():
+        calls.append("hedge")
+        return "hedge"
+
+    assert asyncio.run(run_hedged("k", primary, hedge)) == "primary"
+    assert calls == []
+    assert hedging.hedge_stats["hedged"] == 0
+
+def test_slow_primary_loses_to_hedge_and_is_cancelled():
+    state = {}
+
+    async def primary():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def hedge():
+        return "hedge"
+
+    assert asyncio.run(run_hedged("k", primary, hedge)) == "hedge"
+    assert state == {"cancelled": True}
+    assert hedging.hedge_stats["hedge_wins"] == 1
+
+def test_losing_success_is_discarded():
+    discarded = []
+
+    async def primary():
+        await asyncio.sleep(0.05)
+        return "primary"
+
+    async def hedge():
+        # يكتمل في الجولة نفسها التي يكتمل فيها الأساسي تقريبًا
+        await asyncio.sleep(0.03)
+        return "hedge"
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def main():
+        result = await run_hedged("k", primary, hedge, discard=discard)
+        return result
+
+    result = asyncio.run(main())
+    # الخاسر إما أُلغي قبل اكتماله أو أُغلق عبر discard، ولا يُغلق الفائز أبدًا
+    assert result not in discarded
+    assert len(discarded) <= 1
+
+def test_primary_error_is_raised_when_both_fail():
+    async def primary():
+        await asyncio.sleep(0.05)
+        raise ValueError("primary")
+
+    async def hedge():
+        raise RuntimeError("hedge")
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_hedged("k", primary, hedge))
+
+def test_hedge_rate_is_bounded(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_MAX_RATE", 0.1)
+
+    async def primary():
+        await asyncio.sleep(0.03)
+        return "primary"
+
+    async def hedge():
+        await asyncio.sleep(1)
+
+    async def main():
+        for _ in range(10):
+            await run_hedged("k", primary, hedge)
+
+    asyncio.run(main())
+    assert hedging.hedge_stats["hedged"] == 1
@@ -0,0 +1,38 @@
+import pytest
+from services import job_queue
+from services.job_queue import SQLiteJobQueue
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "jobs.db"))
+
+def test_claimed_job_is_leased_to_one_worker(queue):
+    job_id = queue.enqueue({"user_id": 1})
+    assert queue.claim() == (job_id, {"user_id": 1}, 1)
+    assert queue.claim() is None
+    assert queue.pending_count() == 0
+
+def test_released_job_is_claimed_again(queue):
+    job_id = queue.enqueue({"user_id": 1})
+    queue.claim()
+    queue.release(job_id)
+    assert queue.claim() == (job_id, {"user_id": 1}, 2)
+
+def test_expired_lease_is_reclaimed(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", -1)
+    job_id = queue.enqueue({"user_id": 1})
+    queue.claim()
+    # العامل توقف دون complete أو release
+    assert queue.claim() == (job_id, {"user_id": 1}, 2)
+
+def test_completed_job_is_gone(queue):
+    job_id = queue.enqueue({"user_id": 1})
+    queue.claim()
+    queue.complete(job_id)
+    assert queue.claim() is None
+
+def test_jobs_are_claimed_in_order(queue):
+    first = queue.enqueue({"n": 1})
+    second = queue.enqueue({"n": 2})
+    assert queue.claim()[0] == first
+    assert queue.claim()[0] == second
@@ -0,0 +1,73 @@
+import asyncio
+from types import MappingProxyType
+import pytest
+from services import model_router
+from services.model_router import choose_model, track, OPEN, HALF_OPEN, CLOSED
+
+PLATFORM = "لينكدإن"
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    monkeypatch.setattr(model_router, "_health", {})
+    monkeypatch.setattr(model_router, "MODEL_POOLS", MappingProxyType({PLATFORM: ("a", "b")}))
+    monkeypatch.setattr(model_router, "CIRCUIT_FAILURE_THRESHOLD", 2)
+
+def fail(model):
+    with pytest.raises(RuntimeError):
+        with track(model, PLATFORM):
+            raise RuntimeError("upstream error")
+
+def open_circuit(model):
+    for _ in range(model_router.CIRCUIT_FAILURE_THRESHOLD):
+        fail(model)
+    health = model_router._get_health(model)
+    assert health.state == OPEN
+    return health
+
+def test_failures_open_the_circuit_and_route_around_it():
+    open_circuit("a")
+    assert choose_model(PLATFORM, "a") == "b"
+
+def test_successful_probe_closes_the_circuit():
+    health = open_circuit("a")
+    health.opened_at -= health.cooldown
+    assert choose_model(PLATFORM, "a") == "a"
+    assert health.state == HALF_OPEN
+    with track("a", PLATFORM):
+        pass
+    assert health.state == CLOSED
+
+def test_only_one_probe_at_a_time():
+    health = open_circuit("a")
+    health.opened_at -= health.cooldown
+    assert choose_model(PLATFORM, "a") == "a"
+    assert choose_model(PLATFORM, "a") == "b"
+
+def test_probe_that_never_reaches_track_expires():
+    # المستدعي أُلغي بعد choose_model وقبل track (طلب احتياطي خاسر مثلًا)
+    health = open_circuit("a")
+    health.opened_at -= health.cooldown
+    assert choose_model(PLATFORM, "a") == "a"
+    assert choose_model(PLATFORM, "a") == "b"
+    health.probe_started -= model_router.CIRCUIT_PROBE_TIMEOUT
+    assert choose_model(PLATFORM, "a") == "a"
+
+def test_cancelled_probe_is_released():
+    health = open_circuit("a")
+    health.opened_at -= health.cooldown
+    assert choose_model(PLATFORM, "a") == "a"
+
+    async def cancelled_call():
+        with track("a", PLATFORM):
+            await asyncio.sleep(10)
+
+    async def main():
+        task = asyncio.ensure_future(cancelled_call())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert not health.probe_in_flight
+    assert health.state == HALF_OPEN
+    assert choose_model(PLATFORM, "a") == "a"
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from services import persistence
+from services.persistence import StoragePersistence, persistence_stats
+
+@pytest.fixture(autouse=True)
+def fast_flushes(monkeypatch):
+    monkeypatch.setattr(persistence, "PERSISTENCE_FLUSH_DELAY", 0)
+    monkeypatch.setattr(persistence, "PERSISTENCE_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(persistence, "PERSISTENCE_SINGLE_REPLICA", False)
+
+def test_replicas_reload_state_written_by_each_other():
+    async def main():
+        first, second = StoragePersistence(), StoragePersistence()
+        await first.update_user_data(1, {"step": "platform"})
+        await first.flush()
+
+        seen_by_second = {}
+        await second.refresh_user_data(1, seen_by_second)
+        assert seen_by_second == {"step": "platform"}
+
+        await second.update_user_data(1, {"step": "dialect"})
+        await second.flush()
+
+        # النسخة الأولى كانت تحمل نسخة محلية قديمة
+        seen_by_first = {"step": "platform"}
+        await first.refresh_user_data(1, seen_by_first)
+        assert seen_by_first == {"step": "dialect"}
+
+    asyncio.run(main())
+
+def test_own_writes_are_local_hits():
+    async def main():
+        replica = StoragePersistence()
+        await replica.update_user_data(1, {"step": "platform"})
+        await replica.flush()
+        hits = persistence_stats["local_hits"]
+        user_data = {"step": "platform", "unflushed": True}
+        await replica.refresh_user_data(1, user_data)
+        # لا يُستبدل ما لم يسلّمه PTB بعد
+        assert user_data == {"step": "platform", "unflushed": True}
+        assert persistence_stats["local_hits"] == hits + 1
+
+    asyncio.run(main())
+
+def test_failed_flush_is_retried(memory_storage, monkeypatch):
+    calls = []
+    original = memory_storage.update_bot_states
+
+    def flaky(states):
+        calls.append(states)
+        if len(calls) == 1:
+            raise RuntimeError("storage unavailable")
+        return original(states)
+
+    monkeypatch.setattr(memory_storage, "update_bot_states", flaky)
+
+    async def main():
+        replica = StoragePersistence()
+        await replica.update_user_data(1, {"step": "platform"})
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(calls) >= 2:
+                break
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert memory_storage.get_bot_state(1)[persistence.USER_DATA_FIELD] == {"step": "platform"}
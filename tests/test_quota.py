@@ -0,0 +1,54 @@
+import pytest
+import utils
+
+def test_consume_stops_at_the_limit():
+    results = [utils.try_consume_quota(1, 2) for _ in range(3)]
+    assert results == [(True, 1), (True, 0), (False, 0)]
+
+def test_increment_survives_pending_write_behind(memory_storage):
+    # سجل مؤجل في الطابور ثم زيادة عبر المعاملة: الدفعة التالية لا تعيد العداد
+    utils.save_user_data(1, {"first_name": "a"})
+    utils.increment_user_count(1)
+    utils.flush_user_updates()
+    assert memory_storage.get_user(1)["count"] == 1
+    assert utils.get_user_data(1)["count"] == 1
+
+def test_consume_survives_pending_write_behind(memory_storage):
+    utils.save_user_data(1, {"first_name": "a"})
+    utils.try_consume_quota(1, 5)
+    utils.flush_user_updates()
+    assert memory_storage.get_user(1)["count"] == 1
+
+def test_refund_returns_a_consumed_request():
+    utils.try_consume_quota(1, 2)
+    utils.try_consume_quota(1, 2)
+    utils.refund_quota(1)
+    assert utils.try_consume_quota(1, 2) == (True, 0)
+
+def test_reset_starts_a_new_period():
+    utils.try_consume_quota(1, 1)
+    assert utils.try_consume_quota(1, 1) == (False, 0)
+    utils.reset_user_counts()
+    assert utils.try_consume_quota(1, 1) == (True, 0)
+
+def test_epoch_read_failure_never_grants_a_fresh_quota(memory_storage, monkeypatch):
+    memory_storage.bump_quota_epoch()
+    utils.try_consume_quota(1, 1)
+
+    def unavailable():
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr(memory_storage, "get_quota_epoch", unavailable)
+    utils._quota_epoch_cache.clear()
+    # آخر حقبة معروفة تُستخدم بدل الصفر
+    assert utils.try_consume_quota(1, 1) == (False, 0)
+
+def test_epoch_failure_before_any_read_writes_nothing(memory_storage, monkeypatch):
+    def unavailable():
+        raise RuntimeError("storage unavailable")
+
+    monkeypatch.setattr(memory_storage, "get_quota_epoch", unavailable)
+    assert utils.try_consume_quota(1, 1) == (True, None)
+    assert memory_storage.get_user(1) is None
+    with pytest.raises(RuntimeError):
+        utils.get_quota_epoch()
@@ -0,0 +1,103 @@
+import asyncio
+from collections import deque
+import pytest
+from services import scheduler
+from services.scheduler import generation_slot, GenerationRejected
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler, "_active", 0)
+    monkeypatch.setattr(scheduler, "_waiting", {})
+    monkeypatch.setattr(scheduler, "_rotation", deque())
+    monkeypatch.setattr(scheduler, "QUEUE_POSITION_INTERVAL", 0.01)
+
+def test_slots_cap_concurrent_generations(monkeypatch):
+    monkeypatch.setattr(scheduler, "GENERATION_SLOTS", 2)
+    running = {"now": 0, "peak": 0}
+
+    async def generate(user_id):
+        async with generation_slot(user_id):
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+
+    async def main():
+        await asyncio.gather(*(generate(uid) for uid in range(6)))
+
+    asyncio.run(main())
+    assert running["peak"] == 2
+    assert scheduler.get_active_generations() == 0
+
+def test_waiting_users_take_turns(monkeypatch):
+    monkeypatch.setattr(scheduler, "GENERATION_SLOTS", 1)
+    order = []
+
+    async def generate(user_id):
+        async with generation_slot(user_id):
+            order.append(user_id)
+            await asyncio.sleep(0)
+
+    async def main():
+        blocker = asyncio.Event()
+
+        async def hold():
+            async with generation_slot(0):
+                await blocker.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        # المستخدم 1 يصل بطلبين قبل المستخدم 2، لكن الدور يتناوب بينهما
+        tasks = [asyncio.ensure_future(generate(uid)) for uid in (1, 1, 2)]
+        await asyncio.sleep(0)
+        blocker.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(main())
+    assert order == [1, 2, 1]
+
+def test_full_queue_sheds_without_waiting(monkeypatch):
+    monkeypatch.setattr(scheduler, "GENERATION_SLOTS", 1)
+    monkeypatch.setattr(scheduler, "GENERATION_QUEUE_LIMIT", 1)
+
+    async def main():
+        blocker = asyncio.Event()
+
+        async def hold(user_id):
+            async with generation_slot(user_id):
+                await blocker.wait()
+
+        tasks = [asyncio.ensure_future(hold(1)), asyncio.ensure_future(hold(2))]
+        await asyncio.sleep(0)
+        with pytest.raises(GenerationRejected):
+            async with generation_slot(3):
+                pass
+        blocker.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert scheduler.scheduler_stats["shed"] >= 1
+
+def test_cancelled_waiter_leaves_queue(monkeypatch):
+    monkeypatch.setattr(scheduler, "GENERATION_SLOTS", 1)
+
+    async def main():
+        blocker = asyncio.Event()
+
+        async def hold():
+            async with generation_slot(1):
+                await blocker.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        assert scheduler.get_queue_length() == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.get_queue_length() == 0
+        blocker.set()
+        await holder
+
+    asyncio.run(main())
+    assert scheduler.get_active_generations() == 0
@@ -0,0 +1,82 @@
+"""
+نقل السجلات من التخطيط القديم /logs/{user_id}/{push_id}
+إلى التخطيط المقسم حسب اليوم /post_logs/{YYYY-MM-DD}/{push_id} مع فهرس /post_log_days.
+
+التشغيل من جذر المشروع (يتطلب متغيرات Firebase نفسها التي يستخدمها البوت):
+    python tools/migrate_logs.py [--batch 500] [--delete-old] [--dry-run]
+
+النقل آمن لإعادة التشغيل: مفتاح push يبقى كما هو، فالسجل المنقول مسبقًا يُكتب فوق نفسه.
+لذلك يُعاد حساب فهرس الأيام في النهاية بعدّ مفاتيح /post_logs/{day} بعد النقل.
+"""
+import os
+import sys
+import argparse
+import logging
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firebase_admin import db  # noqa: E402
+from storage.firebase import initialize_firebase  # noqa: E402
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger("migrate_logs")
+
+def migrate_user(user_id: str, batch_size: int, dry_run: bool) -> Counter:
+    posts = db.reference(f"/logs/{user_id}").get() or {}
+    touched_days = Counter()
+    updates = {}
+
+    for push_id, post in posts.items():
+        if not isinstance(post, dict):
+            continue
+        timestamp = post.get("timestamp") or ""
+        day = timestamp[:10] or "unknown"
+        record = dict(post)
+        record["user_id"] = int(user_id) if str(user_id).lstrip("-").isdigit() else user_id
+        updates[f"post_logs/{day}/{push_id}"] = record
+        touched_days[day] += 1
+
+        if len(updates) >= batch_size:
+            if not dry_run:
+                db.reference("/").update(updates)
+            updates = {}
+
+    if updates and not dry_run:
+        db.reference("/").update(updates)
+    return touched_days
+
+def rebuild_day_index(days, dry_run: bool):
+    # العدد الفعلي لكل يوم بعد النقل (يشمل السجلات الجديدة المكتوبة أثناء التشغيل)
+    index = {}
+    for day in days:
+        keys = db.reference(f"/post_logs/{day}").get(shallow=True) or {}
+        index[f"post_log_days/{day}"] = len(keys)
+    if index and not dry_run:
+        db.reference("/").update(index)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate /logs to date-partitioned /post_logs")
+    parser.add_argument("--batch", type=int, default=500, help="عدد السجلات في كل تحديث متعدد المسارات")
+    parser.add_argument("--delete-old", action="store_true", help="حذف /logs/{user_id} بعد نقله")
+    parser.add_argument("--dry-run", action="store_true", help="عرض ما سيتم دون كتابة")
+    args = parser.parse_args()
+
+    initialize_firebase()
+    user_ids = list((db.reference("/logs").get(shallow=True) or {}).keys())
+    logger.info(f"Migrating logs for {len(user_ids)} users")
+
+    all_days = Counter()
+    for i, user_id in enumerate(user_ids, 1):
+        days = migrate_user(user_id, args.batch, args.dry_run)
+        all_days.update(days)
+        if args.delete_old and not args.dry_run:
+            db.reference(f"/logs/{user_id}").delete()
+        if i % 100 == 0:
+            logger.info(f"{i}/{len(user_ids)} users migrated")
+
+    rebuild_day_index(all_days.keys(), args.dry_run)
+    logger.info(f"Migrated {sum(all_days.values())} logs into {len(all_days)} day partitions")
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,83 @@
 import os
-import json
-import firebase_admin
-from firebase_admin import credentials, db
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from collections import Counter
 import logging
-from functools import wraps
+import asyncio
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, partial
 from telegram import Update
 from telegram.ext import ContextTypes
+from cachetools import TTLCache, LRUCache
+from config import CHANNEL_USERNAME
+from storage import get_storage
+from services.metrics import STORAGE_SECONDS, observe
 
 logger = logging.getLogger(__name__)
 
-# ============= تهيئة Firebase =============
-def initialize_firebase():
-    if not firebase_admin._apps:
-        try:
-            cred = credentials.Certificate(json.loads(os.getenv("FIREBASE_CREDENTIALS_JSON")))
-            firebase_admin.initialize_app(cred, {
-                'databaseURL': os.getenv("FIREBASE_DB_URL")
-            })
-        except Exception as e:
-            logger.error(f"Firebase initialization failed: {e}")
-            raise
+# ============= المخزن =============
+# المخزن (Firebase / SQLite / الذاكرة) يُختار بـ STORAGE_BACKEND ويُهيأ عند أول استخدام؛ انظر storage/
+
+# مجمّع خيوط لاستدعاءات المخزن المتزامنة حتى لا تحجب حلقة الأحداث
+# الحجم الافتراضي يطابق حجم مجمّع اتصالات HTTP داخل firebase_admin
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="storage")
 
-initialize_firebase()
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # الزمن يشمل الانتظار في المجمّع لأنه جزء مما يراه المستخدم
+    with observe(STORAGE_SECONDS, operation=func.__name__):
+        return await loop.run_in_executor(_db_executor, partial(func, *args, **kwargs))
 
-REQUIRED_CHANNEL = os.getenv("REQUIRED_CHANNEL", "").strip()
+# القناة المطلوبة: REQUIRED_CHANNEL أو CHANNEL_USERNAME كقيمة احتياطية
+REQUIRED_CHANNEL = (os.getenv("REQUIRED_CHANNEL", "") or CHANNEL_USERNAME or "").strip()
+if REQUIRED_CHANNEL and not REQUIRED_CHANNEL.startswith("@") and not REQUIRED_CHANNEL.lstrip("-").isdigit():
+    REQUIRED_CHANNEL = f"@{REQUIRED_CHANNEL}"
 
 # ============= دوال الاشتراك =============
-async def is_user_subscribed(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+# ذاكرة مؤقتة لنتائج get_chat_member: مدة أطول للمشتركين وأقصر لغير المشتركين
+SUBSCRIPTION_POSITIVE_TTL = int(os.getenv("SUBSCRIPTION_POSITIVE_TTL", "600"))
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "30"))
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+
+_subscribed_cache = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE, ttl=SUBSCRIPTION_POSITIVE_TTL)
+_unsubscribed_cache = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE, ttl=SUBSCRIPTION_NEGATIVE_TTL)
+subscription_cache_stats = {"hits": 0, "misses": 0}
+
+def invalidate_subscription(user_id: int):
+    _subscribed_cache.pop(user_id, None)
+    _unsubscribed_cache.pop(user_id, None)
+
+async def is_user_subscribed(user_id: int, context: ContextTypes.DEFAULT_TYPE, use_cache: bool = True) -> bool:
     if not REQUIRED_CHANNEL:
         return True
+
+    if use_cache:
+        if user_id in _subscribed_cache:
+            subscription_cache_stats["hits"] += 1
+            return True
+        if user_id in _unsubscribed_cache:
+            subscription_cache_stats["hits"] += 1
+            return False
+    subscription_cache_stats["misses"] += 1
+
     try:
         member = await context.bot.get_chat_member(REQUIRED_CHANNEL, user_id)
-        return member.status in ["member", "creator", "administrator"]
     except Exception as e:
-        logger.error(f"Subscription check failed: {e}")
+        # لا نخزّن الأخطاء حتى لا يُحجب المستخدم بسبب عطل مؤقت
+        logger.error(f"Subscription check failed for {user_id}: {e}")
         return False
 
+    subscribed = member.status in ["member", "creator", "administrator"]
+    invalidate_subscription(user_id)
+    if subscribed:
+        _subscribed_cache[user_id] = True
+    else:
+        _unsubscribed_cache[user_id] = True
+    return subscribed
+
 def require_subscription(func):
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
@@ -95,124 +135,601 @@ def require_subscription(func):
 # ============= دوال المستخدمين =============
 def get_all_users() -> dict:
     try:
-        return db.reference("/users").get() or {}
+        return get_storage().get_all_users()
     except Exception as e:
         logger.error(f"Error getting all users: {e}")
         return {}
 
+# ============= ذاكرة ملفات المستخدمين =============
+# نسخة محلية (LRU) من سجلات /users مع كتابة مؤجلة للحقول المتغيرة فقط
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_FLUSH_INTERVAL = int(os.getenv("USER_FLUSH_INTERVAL", "30"))
+
+_user_cache = LRUCache(maxsize=USER_CACHE_SIZE)
+_dirty_users = {}
+_unpersisted_users = set()
+# زيادات عدادات /stats المؤجلة لتُكتب مع دفعة المستخدمين نفسها
+_pending_stats = {}
+_user_cache_lock = threading.Lock()
+
+def _default_user_data() -> dict:
+    return {
+        "count": 0,
+        "date": str(date.today()),
+        "joined": str(date.today()),
+        "first_name": "",
+        "username": "",
+        "last_active": str(datetime.utcnow())
+    }
+
+def _cache_user_record(user_id: int, record: dict):
+    # يجب استدعاؤها مع الاحتفاظ بالقفل؛ الحقول غير المكتوبة بعد لها الأولوية
+    merged = dict(record)
+    merged.update(_dirty_users.get(user_id, {}))
+    _user_cache[user_id] = merged
+    return merged
+
 def get_user_data(user_id: int) -> dict:
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+
     try:
-        return db.reference(f"/users/{user_id}").get() or {
-            "count": 0,
-            "date": str(date.today()),
-            "first_name": "",
-            "username": "",
-            "last_active": str(datetime.utcnow())
-        }
+        data = get_storage().get_user(user_id)
     except Exception as e:
         logger.error(f"Error getting user data: {e}")
         return {"count": 0}
 
+    with _user_cache_lock:
+        if not data:
+            _unpersisted_users.add(user_id)
+        return dict(_cache_user_record(user_id, data or _default_user_data()))
+
 def save_user_data(user_id: int, data: dict):
+    current = get_user_data(user_id)
+    with _user_cache_lock:
+        if user_id in _unpersisted_users:
+            # مستخدم جديد: يُكتب السجل كاملًا في أول دفعة
+            changed = {**current, **data}
+            _unpersisted_users.discard(user_id)
+            _queue_new_user_stats(changed.get("joined") or str(date.today()))
+        else:
+            changed = {k: v for k, v in data.items() if current.get(k) != v}
+        if current.get("blocked") and "blocked" not in data:
+            # تفاعل المستخدم يعني أنه أزال الحظر: يعود إلى قائمة مستلمي الإشعارات
+            changed["blocked"] = None
+            data = {**data, "blocked": None}
+        if not changed:
+            return
+        _dirty_users.setdefault(user_id, {}).update(changed)
+        _cache_user_record(user_id, {**current, **data})
+
+def _queue_new_user_stats(joined: str):
+    # يجب استدعاؤها مع الاحتفاظ بالقفل
+    for path in ("totals/users", f"new_users/{joined}"):
+        _pending_stats[path] = _pending_stats.get(path, 0) + 1
+
+def flush_user_updates() -> int:
+    """يكتب جميع الحقول المؤجلة وزيادات الإحصائيات في تحديث واحد متعدد المسارات"""
+    global _dirty_users, _pending_stats
+    with _user_cache_lock:
+        pending, _dirty_users = _dirty_users, {}
+        stats, _pending_stats = _pending_stats, {}
+    if not pending and not stats:
+        return 0
+
     try:
-        db.reference(f"/users/{user_id}").set(data)
+        get_storage().apply_updates(pending, stats)
+        return len(pending)
     except Exception as e:
-        logger.error(f"Error saving user data: {e}")
+        logger.error(f"Error flushing user updates: {e}")
+        # إعادة الحقول إلى الطابور دون الكتابة فوق قيم أحدث
+        with _user_cache_lock:
+            for uid, fields in pending.items():
+                _dirty_users[uid] = {**fields, **_dirty_users.get(uid, {})}
+            for path, amount in stats.items():
+                _pending_stats[path] = _pending_stats.get(path, 0) + amount
+        return 0
 
-def get_user_limit_status(user_id: int, limit: int = 5) -> bool:
+# ============= دوال الحصة اليومية =============
+class _QuotaExceeded(Exception):
+    pass
+
+# الحصة مرتبطة بفترة "{التاريخ}#{الحقبة}": تغيّر اليوم أو زيادة /quota/epoch
+# يجعل العدادات القديمة صفرًا دون لمس سجلات المستخدمين (التصفير كتابة واحدة)
+QUOTA_EPOCH_TTL = int(os.getenv("QUOTA_EPOCH_TTL", "30"))
+_quota_epoch_cache = TTLCache(maxsize=1, ttl=QUOTA_EPOCH_TTL)
+_quota_epoch_lock = threading.Lock()
+# آخر حقبة قُرئت بنجاح: تبقى بعد انتهاء TTL لتُستخدم إن تعذرت القراءة
+_last_quota_epoch = None
+
+def get_quota_epoch() -> int:
+    """الحقبة الحالية؛ عند تعذر القراءة آخر حقبة معروفة، وإلا يُرفع الخطأ
+
+    الرجوع إلى 0 كان يكتب quota_period بحقبة قديمة فيحصل المستخدم على حصة جديدة.
+    """
+    global _last_quota_epoch
+    with _quota_epoch_lock:
+        epoch = _quota_epoch_cache.get("epoch")
+    if epoch is None:
+        try:
+            epoch = get_storage().get_quota_epoch()
+        except Exception as e:
+            if _last_quota_epoch is None:
+                raise
+            logger.error(f"Error reading quota epoch, using last known epoch {_last_quota_epoch}: {e}")
+            return _last_quota_epoch
+        with _quota_epoch_lock:
+            _quota_epoch_cache["epoch"] = epoch
+            _last_quota_epoch = epoch
+    return epoch
+
+def get_quota_period() -> str:
+    return f"{date.today()}#{get_quota_epoch()}"
+
+def _effective_count(user_data: dict, period: str) -> int:
+    stored = user_data.get("quota_period")
+    if stored is None and user_data.get("date"):
+        # سجلات ما قبل الحقب: تُعامل كأنها في الحقبة 0
+        stored = f"{user_data['date']}#0"
+    if stored != period:
+        return 0
+    return user_data.get("count", 0)
+
+def get_quota_remaining(user_id: int, limit: int = 5) -> int:
     try:
-        user_data = get_user_data(user_id)
-        return user_data.get("count", 0) < limit
+        period = get_quota_period()
     except Exception as e:
-        logger.error(f"Error checking user limit: {e}")
-        return False
+        # للعرض فقط مثل get_user_data؛ الاستهلاك الفعلي يتحقق في try_consume_quota
+        logger.error(f"Error reading quota period: {e}")
+        return limit
+    return max(0, limit - _effective_count(get_user_data(user_id), period))
+
+def try_consume_quota(user_id: int, limit: int = 5) -> tuple:
+    """يستهلك طلبًا من حصة اليوم ذريًا ويعيد (مسموح، المتبقي)"""
+    outcome = {}
+
+    def consume(current):
+        outcome["created"] = not current
+        current = current or {"joined": str(date.today())}
+        count = _effective_count(current, period)
+        if count >= limit:
+            raise _QuotaExceeded()
+        updated = dict(current)
+        updated.update({
+            "count": count + 1,
+            "quota_period": period,
+            "last_active": str(datetime.utcnow())
+        })
+        outcome["remaining"] = limit - count - 1
+        return updated
+
+    try:
+        # داخل try: تعذر قراءة الحقبة يعامل كخطأ قاعدة البيانات ولا يُكتب أي عداد
+        period = get_quota_period()
+        result = get_storage().transact_user(user_id, consume)
+        with _user_cache_lock:
+            # إن كان سجل المستخدم الجديد ما زال في الطابور فقد احتُسب هناك
+            if outcome["created"] and "joined" not in _dirty_users.get(user_id, {}):
+                _queue_new_user_stats(result.get("joined") or str(date.today()))
+            _unpersisted_users.discard(user_id)
+            # العداد يُكتب عبر المعاملة فقط، فلا نسمح للطابور المؤجل بالكتابة فوقه
+            for field in ("count", "quota_period"):
+                _dirty_users.get(user_id, {}).pop(field, None)
+            _cache_user_record(user_id, result)
+        return True, outcome["remaining"]
+    except _QuotaExceeded:
+        return False, 0
+    except Exception as e:
+        # نفس سلوك الإصدارات السابقة: خطأ قاعدة البيانات لا يمنع المستخدم من التوليد
+        logger.error(f"Error consuming user quota: {e}")
+        return True, None
+
+def refund_quota(user_id: int):
+    """يعيد طلبًا استهلكه try_consume_quota ثم رُفض قبل التوليد (ازدحام الطابور)"""
+    try:
+        period = get_quota_period()
+
+        def refund(current):
+            if not current or current.get("quota_period") != period or not current.get("count"):
+                return current
+            updated = dict(current)
+            updated["count"] = current["count"] - 1
+            return updated
+
+        result = get_storage().transact_user(user_id, refund)
+        with _user_cache_lock:
+            for field in ("count", "quota_period"):
+                _dirty_users.get(user_id, {}).pop(field, None)
+            if result:
+                _cache_user_record(user_id, result)
+    except Exception as e:
+        logger.error(f"Error refunding user quota: {e}")
+
+def get_user_limit_status(user_id: int, limit: int = 5) -> bool:
+    return get_quota_remaining(user_id, limit) > 0
 
 def has_reached_limit(user_id: int, limit: int = 5) -> bool:
     return not get_user_limit_status(user_id, limit)
 
 def increment_user_count(user_id: int):
     try:
-        user_ref = db.reference(f"/users/{user_id}")
-        current_data = user_ref.get() or {}
-        current_date = str(date.today())
+        period = get_quota_period()
 
-        if current_data.get("date") != current_date:
-            new_data = {
-                "count": 1,
-                "date": current_date,
+        def increment(current):
+            updated = dict(current or {})
+            updated.update({
+                "count": _effective_count(updated, period) + 1,
+                "quota_period": period,
                 "last_active": str(datetime.utcnow())
-            }
-        else:
-            new_data = {
-                "count": current_data.get("count", 0) + 1,
-                "last_active": str(datetime.utcnow())
-            }
+            })
+            return updated
 
-        user_ref.update(new_data)
+        result = get_storage().transact_user(user_id, increment)
+        with _user_cache_lock:
+            _unpersisted_users.discard(user_id)
+            # كما في try_consume_quota: الطابور المؤجل لا يكتب فوق العداد الذي كتبته المعاملة
+            for field in ("count", "quota_period"):
+                _dirty_users.get(user_id, {}).pop(field, None)
+            _cache_user_record(user_id, result)
     except Exception as e:
         logger.error(f"Error incrementing user count: {e}")
 
 # ============= دوال المنشورات =============
+# السجلات مقسمة حسب اليوم (UTC):
+#   /post_logs/{YYYY-MM-DD}/{push_id} = {user_id, platform, content, timestamp}
+#   /post_log_days/{YYYY-MM-DD} = عدد منشورات اليوم (فهرس الأيام)
+# التخطيط القديم /logs/{user_id}/{push_id} يُنقل بالأداة tools/migrate_logs.py
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+LOG_PRUNE_INTERVAL = int(os.getenv("LOG_PRUNE_INTERVAL", "3600"))
+LOG_PRUNE_CHUNK = int(os.getenv("LOG_PRUNE_CHUNK", "500"))
+
 def get_all_logs() -> dict:
     try:
-        return db.reference("/logs").get() or {}
+        return get_storage().get_logs()
     except Exception as e:
         logger.error(f"Error getting all logs: {e}")
         return {}
 
+def _days_ago(days: int) -> str:
+    return str(datetime.utcnow().date() - timedelta(days=days))
+
+def get_post_counts_by_day(days: int = 7) -> dict:
+    try:
+        start = _days_ago(days - 1)
+        return get_storage().get_post_counts(start)
+    except Exception as e:
+        logger.error(f"Error getting post counts: {e}")
+        return {}
+
+def prune_old_logs(retention_days: int = LOG_RETENTION_DAYS, chunk: int = LOG_PRUNE_CHUNK) -> int:
+    """يحذف جزءًا محدودًا من أقدم الأيام المنتهية صلاحيتها في كل استدعاء"""
+    return get_storage().prune_logs(_days_ago(retention_days), chunk)
+
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+def make_push_id() -> str:
+    """مفتاح مرتب زمنيًا بصيغة مفاتيح push في Firebase يُولَّد محليًا دون طلب شبكة"""
+    now = int(time.time() * 1000)
+    stamp = []
+    for _ in range(8):
+        stamp.append(_PUSH_CHARS[now % 64])
+        now //= 64
+    return "".join(reversed(stamp)) + "".join(random.choice(_PUSH_CHARS) for _ in range(12))
+
+def _make_log_entry(user_id: int, platform: str, content: str) -> tuple:
+    """(day, push_id, record): المفتاح يُولَّد مرة واحدة فتكتب إعادة المحاولة فوق السجل نفسه"""
+    record = {
+        "user_id": user_id,
+        "platform": platform,
+        "content": content,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    return record["timestamp"][:10], make_push_id(), record
+
+def write_post_logs(entries: list):
+    """يكتب دفعة سجلات مع فهرس الأيام وعدادات الإحصائيات في كتابة واحدة"""
+    platforms = Counter(record["platform"] for _, _, record in entries)
+    stats = {"totals/posts": len(entries)}
+    stats.update({f"platforms/{platform}": amount for platform, amount in platforms.items()})
+    get_storage().append_logs(entries, stats)
+
+def log_batch_written(entries: list) -> bool:
+    """الكتابة ذرية: وجود أول سجل يعني أن الدفعة كلها (مع عداداتها) كُتبت"""
+    day, push_id, _ = entries[0]
+    return get_storage().has_log(day, push_id)
+
 def log_post(user_id: int, platform: str, content: str):
     try:
-        post_ref = db.reference(f"/logs/{user_id}").push()
-        post_ref.set({
-            "platform": platform,
-            "content": content,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        write_post_logs([_make_log_entry(user_id, platform, content)])
     except Exception as e:
         logger.error(f"Error logging post: {e}")
 
-# ============= دوال الإحصائيات =============
-def get_platform_usage(limit: int = 5) -> list:
+# ============= طابور كتابة السجلات =============
+# السجلات تُجمع في الذاكرة وتُكتب دفعةً واحدة كل فترة أو عند امتلاء الدفعة
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "5000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "5"))
+# أقصى انتظار عند امتلاء الطابور قبل إسقاط السجل
+LOG_ENQUEUE_TIMEOUT = float(os.getenv("LOG_ENQUEUE_TIMEOUT", "0.5"))
+LOG_WRITE_RETRIES = 3
+
+_log_queue = None
+_log_sink_task = None
+# علامة الإيقاف: الكاتب يكتب دفعته الجارية ثم يخرج (بدل cancel الذي قد يضيع داخل wait_for)
+_LOG_SINK_STOP = object()
+log_sink_stats = {"queued": 0, "written": 0, "dropped": 0, "batches": 0}
+
+def _get_log_queue() -> asyncio.Queue:
+    global _log_queue
+    if _log_queue is None:
+        _log_queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    return _log_queue
+
+async def _write_log_batch(batch: list):
     try:
-        logs = get_all_logs()
-        platforms = []
-        
-        for user_logs in logs.values():
-            if isinstance(user_logs, dict):
-                for post in user_logs.values():
-                    if isinstance(post, dict) and post.get("platform"):
-                        platforms.append(post["platform"])
+        for attempt in range(LOG_WRITE_RETRIES):
+            try:
+                # بعد فشل قد تكون الكتابة السابقة نجحت وضاع ردها فقط؛ لا نكررها فتتضاعف العدادات
+                if not (attempt and await run_db(log_batch_written, batch)):
+                    await run_db(write_post_logs, batch)
+                log_sink_stats["written"] += len(batch)
+                log_sink_stats["batches"] += 1
+                return
+            except Exception as e:
+                logger.error(f"Error writing log batch (attempt {attempt + 1}): {e}")
+            if attempt + 1 < LOG_WRITE_RETRIES:
+                await asyncio.sleep(2 ** attempt)
+    except asyncio.CancelledError:
+        log_sink_stats["dropped"] += len(batch)
+        logger.error(f"Log writer cancelled, dropped {len(batch)} post logs")
+        raise
+    log_sink_stats["dropped"] += len(batch)
+
+async def _run_log_sink():
+    queue = _get_log_queue()
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        batch = []
+        try:
+            entry = await queue.get()
+            if entry is _LOG_SINK_STOP:
+                return
+            batch.append(entry)
+            deadline = loop.time() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _LOG_SINK_STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+        except asyncio.CancelledError:
+            if batch:
+                log_sink_stats["dropped"] += len(batch)
+                logger.error(f"Log sink cancelled, dropped {len(batch)} post logs")
+            raise
+        await _write_log_batch(batch)
+
+def start_log_sink():
+    global _log_sink_task
+    if _log_sink_task is None:
+        _log_sink_task = asyncio.get_running_loop().create_task(_run_log_sink())
+
+async def stop_log_sink() -> int:
+    """يوقف الكاتب الخلفي بعد كتابة دفعته الجارية ثم يكتب كل ما تبقى في الطابور"""
+    global _log_sink_task, _log_queue
+    if _log_sink_task is not None:
+        await _get_log_queue().put(_LOG_SINK_STOP)
+        try:
+            await _log_sink_task
+        except Exception as e:
+            logger.error(f"Log sink failed: {e}")
+        _log_sink_task = None
 
-        return Counter(platforms).most_common(limit) if platforms else []
+    if _log_queue is None:
+        return 0
+    remaining = []
+    while not _log_queue.empty():
+        entry = _log_queue.get_nowait()
+        if entry is not _LOG_SINK_STOP:
+            remaining.append(entry)
+    # طابور جديد عند التشغيل التالي (قد يكون على حلقة أحداث أخرى)
+    _log_queue = None
+    for start in range(0, len(remaining), LOG_BATCH_SIZE):
+        await _write_log_batch(remaining[start:start + LOG_BATCH_SIZE])
+    return len(remaining)
+
+def get_log_queue_depth() -> int:
+    return _log_queue.qsize() if _log_queue is not None else 0
+
+# ============= دوال الإحصائيات =============
+# عدادات تُحدَّث عند الكتابة تحت /stats:
+#   totals/users, totals/posts, platforms/{platform}, new_users/{YYYY-MM-DD}
+def get_stats() -> dict:
+    try:
+        storage = get_storage()
+        totals = storage.get_stat_group("totals")
+        platforms = storage.get_stat_group("platforms")
+        new_users = storage.get_stat(f"new_users/{date.today()}")
+        return {
+            "total_users": totals.get("users", 0),
+            "total_posts": totals.get("posts", 0),
+            "new_users_today": new_users,
+            "platforms": Counter(platforms).most_common()
+        }
     except Exception as e:
-        logger.error(f"Error getting platform usage: {e}")
-        return []
+        logger.error(f"Error getting stats: {e}")
+        return {"total_users": 0, "total_posts": 0, "new_users_today": 0, "platforms": []}
+
+def get_platform_usage(limit: int = 5) -> list:
+    return get_stats()["platforms"][:limit]
 
 def get_daily_new_users() -> int:
+    return get_stats()["new_users_today"]
+
+def rebuild_stats() -> dict:
+    """يعيد حساب /stats من البيانات الكاملة (للإصلاح فقط، يقرأ القاعدة كلها)"""
     try:
         users = get_all_users()
-        today = str(date.today())
-        return sum(1 for u in users.values() if u.get('date') == today)
+        logs = get_all_logs()
+        platforms = Counter()
+        total_posts = 0
+
+        for day_logs in logs.values():
+            if isinstance(day_logs, dict):
+                for post in day_logs.values():
+                    if isinstance(post, dict):
+                        total_posts += 1
+                        if post.get("platform"):
+                            platforms[post["platform"]] += 1
+
+        new_users = Counter(
+            u.get("joined") or u.get("date")
+            for u in users.values()
+            if isinstance(u, dict) and (u.get("joined") or u.get("date"))
+        )
+        stats = {
+            "totals": {"users": len(users), "posts": total_posts},
+            "platforms": dict(platforms),
+            "new_users": dict(new_users)
+        }
+        get_storage().replace_stats(stats)
+        logger.info("Stats rebuilt successfully")
+        return stats
     except Exception as e:
-        logger.error(f"Error getting daily new users: {e}")
-        return 0
+        logger.error(f"Error rebuilding stats: {e}")
+        raise
 
 # ============= دوال الإدارة =============
 def reset_user_counts():
+    """يصفّر حصص جميع المستخدمين بزيادة الحقبة فقط (كتابة واحدة ثابتة الحجم)"""
+    global _last_quota_epoch
     try:
-        users_ref = db.reference("/users")
-        users = users_ref.get() or {}
-        updates = {f"{uid}/count": 0 for uid in users}
-        users_ref.update(updates)
-        logger.info("User counts reset successfully")
+        epoch = get_storage().bump_quota_epoch()
+        with _quota_epoch_lock:
+            _quota_epoch_cache["epoch"] = epoch
+            _last_quota_epoch = epoch
+        logger.info(f"User counts reset successfully (quota epoch {epoch})")
     except Exception as e:
         logger.error(f"Error resetting user counts: {e}")
         raise
 
 def clear_all_logs():
     try:
-        db.reference("/logs").delete()
+        get_storage().clear_logs()
         logger.info("All logs cleared successfully")
     except Exception as e:
         logger.error(f"Error clearing logs: {e}")
         raise
+
+# ============= دوال الإشعارات العامة =============
+def get_broadcast_recipients(after_user_id: int = None) -> list:
+    """معرّفات المستخدمين مرتبة تصاعديًا مع استبعاد من حظروا البوت"""
+    return get_storage().get_recipient_ids(after_user_id)
+
+def mark_users_blocked(user_ids: list):
+    if not user_ids:
+        return
+    try:
+        get_storage().mark_users_blocked(user_ids)
+        with _user_cache_lock:
+            for uid in user_ids:
+                _user_cache.pop(uid, None)
+    except Exception as e:
+        logger.error(f"Error marking blocked users: {e}")
+
+def save_broadcast_state(broadcast_id: str, state: dict):
+    try:
+        get_storage().save_broadcast(broadcast_id, state)
+    except Exception as e:
+        logger.error(f"Error saving broadcast state: {e}")
+
+def transact_broadcast(broadcast_id: str, func) -> dict:
+    # بلا التقاط للأخطاء: المستدعي يقرر (فشل الحجز أو فشل التخزين)
+    return get_storage().transact_broadcast(broadcast_id, func)
+
+def get_active_broadcasts() -> dict:
+    try:
+        broadcasts = get_storage().get_broadcasts()
+        return {bid: state for bid, state in broadcasts.items() if state.get("status") == "running"}
+    except Exception as e:
+        logger.error(f"Error getting active broadcasts: {e}")
+        return {}
+
+# ============= الواجهة غير المتزامنة =============
+async def get_all_users_async() -> dict:
+    return await run_db(get_all_users)
+
+async def get_user_data_async(user_id: int) -> dict:
+    return await run_db(get_user_data, user_id)
+
+async def save_user_data_async(user_id: int, data: dict):
+    return await run_db(save_user_data, user_id, data)
+
+async def flush_user_updates_async() -> int:
+    return await run_db(flush_user_updates)
+
+async def increment_user_count_async(user_id: int):
+    return await run_db(increment_user_count, user_id)
+
+async def get_quota_remaining_async(user_id: int, limit: int = 5) -> int:
+    return await run_db(get_quota_remaining, user_id, limit)
+
+async def try_consume_quota_async(user_id: int, limit: int = 5) -> tuple:
+    return await run_db(try_consume_quota, user_id, limit)
+
+async def refund_quota_async(user_id: int):
+    return await run_db(refund_quota, user_id)
+
+async def get_post_counts_by_day_async(days: int = 7) -> dict:
+    return await run_db(get_post_counts_by_day, days)
+
+async def prune_old_logs_async(retention_days: int = LOG_RETENTION_DAYS) -> int:
+    return await run_db(prune_old_logs, retention_days)
+
+async def log_post_async(user_id: int, platform: str, content: str):
+    if _log_sink_task is None:
+        return await run_db(log_post, user_id, platform, content)
+
+    entry = _make_log_entry(user_id, platform, content)
+    try:
+        await asyncio.wait_for(_get_log_queue().put(entry), LOG_ENQUEUE_TIMEOUT)
+        log_sink_stats["queued"] += 1
+    except asyncio.TimeoutError:
+        log_sink_stats["dropped"] += 1
+        logger.warning(f"Log queue full, dropped post log for {user_id}")
+
+async def get_stats_async() -> dict:
+    return await run_db(get_stats)
+
+async def rebuild_stats_async() -> dict:
+    return await run_db(rebuild_stats)
+
+async def reset_user_counts_async():
+    return await run_db(reset_user_counts)
+
+async def clear_all_logs_async():
+    return await run_db(clear_all_logs)
+
+async def get_broadcast_recipients_async(after_user_id: int = None) -> list:
+    return await run_db(get_broadcast_recipients, after_user_id)
+
+async def mark_users_blocked_async(user_ids: list):
+    return await run_db(mark_users_blocked, user_ids)
+
+async def save_broadcast_state_async(broadcast_id: str, state: dict):
+    return await run_db(save_broadcast_state, broadcast_id, state)
+
+async def transact_broadcast_async(broadcast_id: str, func) -> dict:
+    return await run_db(transact_broadcast, broadcast_id, func)
+
+async def get_active_broadcasts_async() -> dict:
+    return await run_db(get_active_broadcasts)
@@ -0,0 +1,139 @@
+"""
+عمال التوليد لوضع الطابور (GENERATION_MODE=queue).
+
+البوت (main.py) يضيف مهمة لكل طلب توليد إلى طابور المهام ويعود فورًا،
+وهذه العمليات تسحب المهام وتستدعي generate_response وترسل الرد وتسجل المنشور.
+
+التشغيل (بنفس متغيرات البيئة التي يستخدمها البوت):
+    python worker.py --processes 4 --concurrency 10
+"""
+import os
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from telegram import Bot
+from telegram.error import TelegramError
+from config import TOKEN
+from services.job_queue import get_job_queue, JOB_MAX_ATTEMPTS
+from services.openai_service import generate_response
+from handlers.generate import STREAMING_ENABLED, make_progress_editor, safe_edit, remaining_message
+from utils import run_db, log_post_async, start_log_sink, stop_log_sink
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "2"))
+# مهام متزامنة داخل كل عملية
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "10"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+FAILURE_TEXT = "⚠️ حدث خطأ أثناء إنشاء المنشور. حاول مجددًا."
+
+logger = logging.getLogger("worker")
+
+class MessageRef:
+    """بديل خفيف لكائن Message يكفي safe_edit وmake_progress_editor"""
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+
+async def process_job(bot: Bot, payload: dict, attempts: int):
+    msg = MessageRef(bot, payload["chat_id"], payload["message_id"])
+    if attempts > JOB_MAX_ATTEMPTS:
+        await safe_edit(msg, FAILURE_TEXT)
+        return
+
+    await safe_edit(msg, "⏳ يتم إنشاء المنشور...")
+    result = await generate_response(
+        payload["user_input"], payload["platform"], payload["dialect"],
+        on_progress=make_progress_editor(msg) if STREAMING_ENABLED else None
+    )
+    if not await safe_edit(msg, result):
+        await bot.send_message(payload["chat_id"], result)
+    # التسجيل بعد التسليم فقط: فشل الإرسال يعيد المهمة، ولا خطوة بعده تعيدها فيُسجَّل مرتين
+    await log_post_async(payload["user_id"], payload["platform"], result)
+    if payload.get("remaining") is not None:
+        try:
+            await bot.send_message(payload["chat_id"], remaining_message(payload["remaining"]))
+        except TelegramError as e:
+            logger.warning(f"Failed to send remaining quota notice to {payload['chat_id']}: {e}")
+
+async def run_slot(bot: Bot, stopping: asyncio.Event):
+    queue = get_job_queue()
+    while not stopping.is_set():
+        job = await run_db(queue.claim)
+        if job is None:
+            try:
+                await asyncio.wait_for(stopping.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        job_id, payload, attempts = job
+        try:
+            await process_job(bot, payload, attempts)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed on attempt {attempts}: {e}")
+            await run_db(queue.release, job_id)
+            continue
+        await run_db(queue.complete, job_id)
+
+async def run_worker(concurrency: int):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    async with Bot(TOKEN) as bot:
+        start_log_sink()
+        try:
+            # المهام الجارية تكتمل قبل الخروج؛ لا تُسحب مهام جديدة بعد الإشارة
+            await asyncio.gather(*(run_slot(bot, stopping) for _ in range(concurrency)))
+        finally:
+            logs = await stop_log_sink()
+            logger.info(f"Worker {os.getpid()} stopped, flushed {logs} queued post logs")
+
+def worker_process(concurrency: int):
+    log_file = os.getenv("LOG_FILE", "bot_errors.log")
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        handlers=[logging.StreamHandler()] + (
+            [logging.FileHandler(log_file, encoding='utf-8', delay=True)] if log_file else []
+        )
+    )
+    asyncio.run(run_worker(concurrency))
+
+def main():
+    parser = argparse.ArgumentParser(description="Generation workers for GENERATION_MODE=queue")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES, help="عدد عمليات العمال")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="مهام متزامنة لكل عملية")
+    args = parser.parse_args()
+
+    if not TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN is missing or not set in environment variables.")
+    if args.processes <= 1:
+        worker_process(args.concurrency)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=worker_process, args=(args.concurrency,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()